@@ -13,8 +13,11 @@ class_idx = json.load(
 
 
 def pre_process(input_):
-    img = cv2.resize(input_, (224, 224))
-    return np.expand_dims(np.divide(img.astype(np.float32), 255), 0)
+    # The platform already resizes images when 'size' is declared in imagenet.json
+    if input_.shape[:2] != (224, 224):
+        input_ = cv2.resize(input_, (224, 224))
+    # Converts and scales in a single allocation
+    return np.multiply(input_, np.float32(1 / 255), dtype=np.float32)[np.newaxis]
 
 
 def post_process(output):
@@ -0,0 +1,151 @@
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+SAMPLE_PATH = os.path.dirname(os.path.abspath(__file__))
+DATA_PATH = os.path.join(SAMPLE_PATH, 'utils', 'data')
+DATASET_PATH = os.path.join(SAMPLE_PATH, 'utils', 'dataset', 'yelp_academic_dataset_review.json')
+
+
+def read_reviews(dataset_path, count):
+    '''
+    Args:
+        dataset_path (string): a Yelp reviews file, one JSON object with a 'text' per line
+        count (int): the number of reviews to read
+    Returns:
+        The text of the first reviews
+    '''
+    reviews = []
+    with open(dataset_path) as dataset_file:
+        for line in dataset_file:
+            if line.startswith('version https://git-lfs'):
+                sys.exit("'" + dataset_path + "' is a Git LFS pointer. Run 'git lfs pull' to download the dataset.")
+            reviews.append(json.loads(line)['text'])
+            if len(reviews) == count:
+                break
+    return reviews
+
+
+def load_vectorizers():
+    with open(os.path.join(DATA_PATH, 'tdif.pkl'), 'rb') as tdif_file:
+        tdif = pickle.load(tdif_file)
+    with open(os.path.join(DATA_PATH, 'count.pkl'), 'rb') as count_file:
+        count = pickle.load(count_file)
+    return tdif, count
+
+
+# What the formatter did before: load the vectorizers and build a dense array on every request
+def pre_process_dense(text):
+    tdif, count = load_vectorizers()
+    return tdif.transform(count.transform([text])).toarray()
+
+
+def summarize(durations, input_bytes=None):
+    durations_ms = np.array(durations) * 1000
+    summary = {"requests": len(durations),
+               "mean_ms": round(float(durations_ms.mean()), 3),
+               "p50_ms": round(float(np.percentile(durations_ms, 50)), 3),
+               "p95_ms": round(float(np.percentile(durations_ms, 95)), 3),
+               "p99_ms": round(float(np.percentile(durations_ms, 99)), 3)}
+    if input_bytes is not None:
+        summary['mean_input_bytes'] = int(np.mean(input_bytes))
+    return summary
+
+
+def to_coo_tensors(features):
+    # The 'indices', 'values' and 'dense_shape' tensors sent for models declaring a 'sparse' input
+    coo_features = features.tocoo()
+    return [np.stack([coo_features.row, coo_features.col], axis=1).astype(np.int64),
+            coo_features.data,
+            np.array(features.shape, dtype=np.int64)]
+
+
+def benchmark_pre_process(reviews):
+    '''
+    Compares the time to build the model input of each review and the bytes sent to RedisAI:
+    "dense" loads the vectorizers on every request (what version 1 did before), "cached" keeps them
+    loaded and sends the dense vector (version 1), and "sparse" sends the non-zero entries
+    as COO tensors (version 2, in samples/sentiment_analysis_sparse).
+    '''
+    durations, input_bytes = [], []
+    for text in reviews:
+        start = time.perf_counter()
+        features = pre_process_dense(text)
+        durations.append(time.perf_counter() - start)
+        input_bytes.append(features.nbytes)
+    dense = summarize(durations, input_bytes)
+
+    tdif, count = load_vectorizers()
+    durations, input_bytes = [], []
+    for text in reviews:
+        start = time.perf_counter()
+        features = tdif.transform(count.transform([text])).toarray()
+        durations.append(time.perf_counter() - start)
+        input_bytes.append(features.nbytes)
+    cached = summarize(durations, input_bytes)
+
+    durations, input_bytes = [], []
+    for text in reviews:
+        start = time.perf_counter()
+        tensors = to_coo_tensors(tdif.transform(count.transform([text])))
+        durations.append(time.perf_counter() - start)
+        input_bytes.append(sum(tensor.nbytes for tensor in tensors))
+    sparse = summarize(durations, input_bytes)
+
+    return {"dense": dense, "cached": cached, "sparse": sparse}
+
+
+def send_review(url, text):
+    # Inference endpoints only accept GET, which urllib does not use for requests with a body by default
+    inference_request = urllib.request.Request(url,
+                                               data=json.dumps({"input": text}).encode('utf-8'),
+                                               headers={"Content-Type": "application/json"},
+                                               method='GET')
+    start = time.perf_counter()
+    with urllib.request.urlopen(inference_request) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def benchmark_service(url, reviews, concurrency):
+    '''
+    Sends every review to a running inference service, 'concurrency' requests at a time.
+    '''
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        durations = list(executor.map(lambda text: send_review(url, text), reviews))
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(durations)
+    summary['concurrency'] = concurrency
+    summary['requests_per_second'] = round(len(reviews) / elapsed, 3)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the sentiment sample with the reviews of the Yelp dataset")
+    parser.add_argument('--dataset', default=DATASET_PATH,
+                        help="the Yelp reviews file, one JSON object per line")
+    parser.add_argument('--reviews', type=int, default=1000,
+                        help="the number of reviews to run")
+    parser.add_argument('--url', action='append', default=[],
+                        help="an inference endpoint to load test, repeated to compare versions. "
+                             "Ex: --url http://localhost/inference/sentiment/1/ --url http://localhost/inference/sentiment/2/")
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="the number of requests in flight during the load test")
+    args = parser.parse_args()
+
+    reviews = read_reviews(args.dataset, args.reviews)
+    results = {"pre_process": benchmark_pre_process(reviews)}
+    if args.url:
+        results['service'] = {url: benchmark_service(url, reviews, args.concurrency) for url in args.url}
+    print(json.dumps(results, indent=4))
@@ -15,10 +15,17 @@ data_path = os.path.join(models_path, 'sentiment', '1', 'utils', 'data')
 sentiment = {0: "This is bad!", 1: "This is good!"}
 
 
+# The fitted vectorizers are loaded once, when the worker imports this script, instead of on every request
+with open(os.path.join(data_path, 'tdif.pkl'), 'rb') as tdif_file:
+    tdif = pickle.load(tdif_file)
+with open(os.path.join(data_path, 'count.pkl'), 'rb') as count_file:
+    count = pickle.load(count_file)
+
+
+# Returns the sparse TF-IDF features: the inference service only makes them dense
+# (in a buffer reused across requests) for models that do not take sparse inputs
 def pre_process(text):
-    tdif = pickle.load(open(data_path + '/tdif.pkl', 'rb'))
-    count = pickle.load(open(data_path + '/count.pkl', 'rb'))
-    return tdif.transform(count.transform([text])).toarray()
+    return tdif.transform(count.transform([text]))
 
 
 def post_process(output):
@@ -0,0 +1,61 @@
+import os
+import argparse
+
+import onnx
+
+from onnx import TensorProto, helper
+
+SAMPLE_PATH = os.path.dirname(os.path.abspath(__file__))
+DENSE_MODEL_PATH = os.path.join(SAMPLE_PATH, '..', 'sentiment_analysis', 'sentiment.onnx')
+
+
+def export_sparse_model(dense_model_path, sparse_model_path):
+    '''
+    Builds the sparse input version of the sentiment classifier from the bundled dense one.
+    The model takes the 'indices', 'values' and 'dense_shape' tensors the inference service
+    sends for models declaring a 'sparse' input, and scatters them into the dense features
+    inside RedisAI, so requests never send the 97657 wide TF-IDF vector.
+    The batch dimension is left free, so inputs of concurrent requests can be batched, and the
+    probabilities are returned as a [batch, 2] tensor instead of a map per sample.
+
+    Args:
+        dense_model_path (string): the sklearn classifier exported by skl2onnx
+        sparse_model_path (string): where the sparse input model is written
+    '''
+    dense_model = onnx.load(dense_model_path)
+    dense_graph = dense_model.graph
+    features = dense_graph.input[0]
+
+    nodes = [helper.make_node('ConstantOfShape', ['dense_shape'], ['zeros'],
+                              value=helper.make_tensor('value', features.type.tensor_type.elem_type, [1], [0])),
+             helper.make_node('ScatterND', ['zeros', 'indices', 'values'], [features.name])]
+    nodes += [node for node in dense_graph.node if node.op_type != 'ZipMap']
+
+    graph = helper.make_graph(
+        nodes,
+        'sentiment_sparse',
+        [helper.make_tensor_value_info('indices', TensorProto.INT64, ['nnz', 2]),
+         helper.make_tensor_value_info('values', features.type.tensor_type.elem_type, ['nnz']),
+         helper.make_tensor_value_info('dense_shape', TensorProto.INT64, [2])],
+        [helper.make_tensor_value_info('output_label', TensorProto.INT64, ['batch']),
+         helper.make_tensor_value_info('probabilities', TensorProto.FLOAT, ['batch', 2])],
+        initializer=dense_graph.initializer)
+
+    # ScatterND needs opset 11. IR version 6 is the newest the ONNX Runtime of RedisAI 1.0 reads.
+    sparse_model = helper.make_model(graph,
+                                     producer_name='export_model',
+                                     opset_imports=[helper.make_opsetid('', 11),
+                                                    helper.make_opsetid('ai.onnx.ml', 1)])
+    sparse_model.ir_version = 6
+    onnx.checker.check_model(sparse_model)
+    onnx.save(sparse_model, sparse_model_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Builds the sparse input version of the sentiment sample from the dense one")
+    parser.add_argument('--dense-model', default=DENSE_MODEL_PATH)
+    parser.add_argument('--output', default=os.path.join(SAMPLE_PATH, 'sentiment.onnx'))
+    args = parser.parse_args()
+
+    export_sparse_model(args.dense_model, args.output)
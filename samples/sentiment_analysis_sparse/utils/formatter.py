@@ -0,0 +1,32 @@
+import pickle
+import os
+
+import logging
+
+from flask import jsonify
+
+logging.basicConfig(format='%(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+models_path = os.environ['MODELS_ROOT_PATH_INFERENCE']
+
+data_path = os.path.join(models_path, 'sentiment', '2', 'utils', 'data')
+
+sentiment = {0: "This is bad!", 1: "This is good!"}
+
+
+# The fitted vectorizers are loaded once, when the worker imports this script, instead of on every request
+with open(os.path.join(data_path, 'tdif.pkl'), 'rb') as tdif_file:
+    tdif = pickle.load(tdif_file)
+with open(os.path.join(data_path, 'count.pkl'), 'rb') as count_file:
+    count = pickle.load(count_file)
+
+
+# Returns the sparse TF-IDF features. This version declares a 'sparse' input, so only their non-zero
+# entries are sent to RedisAI, where the model scatters them into the dense vector
+def pre_process(text):
+    return tdif.transform(count.transform([text]))
+
+
+def post_process(output):
+    return {"sentiment": sentiment[int(output[0][0])]}
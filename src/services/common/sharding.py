@@ -0,0 +1,125 @@
+import os
+import time
+import redis
+import bisect
+import random
+import hashlib
+import redisai
+
+# RedisAI nodes as 'host:port' pairs. The first one also holds the queues, jobs, model status and profiles.
+# Ex: REDISAI_NODES=redisai-0:6379,redisai-1:6379,redisai-2:6379
+REDISAI_NODES = [node.strip()
+                 for node in os.environ.get('REDISAI_NODES', 'redisai:6379').split(',')
+                 if node.strip()]
+
+# Nodes holding each model version, unless its <model_name>.json asks for more ('replicas')
+REDISAI_REPLICAS = int(os.environ.get('REDISAI_REPLICAS', '1'))
+
+# Connections kept by each worker for a node. Threads wait for a free connection beyond that.
+REDISAI_MAX_CONNECTIONS = int(os.environ.get('REDISAI_MAX_CONNECTIONS', '50'))
+
+# Points of each node on the ring. More points spread model versions more evenly.
+REDISAI_VIRTUAL_NODES = int(os.environ.get('REDISAI_VIRTUAL_NODES', '160'))
+
+# Processes read the nodes holding a model version at most once per interval
+REDISAI_HOLDERS_REFRESH_INTERVAL = float(os.environ.get('REDISAI_HOLDERS_REFRESH_INTERVAL', '1'))
+
+
+def hash_key(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    '''
+    Places keys on nodes with consistent hashing, so adding or removing a node
+    only moves the keys between that node and its neighbours on the ring.
+    '''
+
+    def __init__(self, nodes, virtual_nodes=REDISAI_VIRTUAL_NODES):
+        self.nodes = list(nodes)
+        points = sorted((hash_key(node + '#' + str(i)), node)
+                        for node in self.nodes
+                        for i in range(virtual_nodes))
+        self.hashes = [point for point, _ in points]
+        self.owners = [node for _, node in points]
+
+    def get_nodes(self, key, replicas=1):
+        '''
+        Returns:
+            The first 'replicas' distinct nodes found clockwise from the key
+        '''
+        nodes = []
+        index = bisect.bisect(self.hashes, hash_key(key))
+        while len(nodes) < min(replicas, len(self.nodes)):
+            node = self.owners[index % len(self.owners)]
+            if node not in nodes:
+                nodes.append(node)
+            index += 1
+        return nodes
+
+
+def create_client(node):
+    host, _, port = node.rpartition(':')
+    # Pools check the process id, so every (gunicorn) worker opens its own connections
+    return redisai.Client(connection_pool=redis.BlockingConnectionPool(host=host,
+                                                                       port=int(port),
+                                                                       max_connections=REDISAI_MAX_CONNECTIONS))
+
+
+ring = HashRing(REDISAI_NODES)
+
+clients = {node: create_client(node) for node in REDISAI_NODES}
+
+control_client = clients[REDISAI_NODES[0]]
+
+# model version -> (checked_at, nodes), for this process
+holders_cache = {}
+
+
+def get_replicas(model):
+    '''
+    Args:
+        model (dict): the 'model' object from <model_name>.json
+    '''
+    return model.get('replicas', REDISAI_REPLICAS)
+
+
+def model_nodes(model_key, replicas=REDISAI_REPLICAS):
+    '''
+    Args:
+        model_key (string): the model version
+            Ex: iris/1
+    Returns:
+        The nodes ('host:port') holding the model version
+    '''
+    return ring.get_nodes(model_key, replicas)
+
+
+def model_clients(model_key, replicas=REDISAI_REPLICAS):
+    return [clients[node] for node in model_nodes(model_key, replicas)]
+
+
+def get_holders(model_key, replicas=REDISAI_REPLICAS):
+    '''
+    Returns:
+        The nodes model_add last set the version on (the 'nodes' of its 'model_info' hash) that are
+        still in REDISAI_NODES, or the nodes the ring assigns when none is known. After REDISAI_NODES
+        changes, requests keep going to the previous nodes until model_add set the version on the new ones.
+    '''
+    checked_at, nodes = holders_cache.get(model_key, (0, None))
+    if time.monotonic() - checked_at > REDISAI_HOLDERS_REFRESH_INTERVAL:
+        recorded_nodes = control_client.hget('model_info:' + model_key, 'nodes')
+        nodes = [node
+                 for node in (recorded_nodes or b'').decode('utf-8').split(',')
+                 if node in clients]
+        holders_cache[model_key] = (time.monotonic(), nodes)
+    return nodes or model_nodes(model_key, replicas)
+
+
+def model_client(model_key, replicas=REDISAI_REPLICAS):
+    '''
+    Returns:
+        The client of one of the nodes holding the model version. Requests of models
+        with many replicas are spread over them.
+    '''
+    return clients[random.choice(get_holders(model_key, replicas))]
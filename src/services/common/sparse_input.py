@@ -0,0 +1,73 @@
+import threading
+
+import numpy as np
+
+# Dense buffers of each thread, reused by every request densifying sparse features
+dense_buffers = threading.local()
+
+
+def is_sparse(input_):
+    # scipy.sparse matrices, recognized without importing scipy for models that never use them
+    return hasattr(input_, 'tocsr') and hasattr(input_, 'nnz')
+
+
+def get_dense_buffer(rows, columns, dtype):
+    if not hasattr(dense_buffers, 'shapes'):
+        dense_buffers.shapes = {}
+    dense_buffer = dense_buffers.shapes.get((columns, dtype))
+    if dense_buffer is None or dense_buffer.shape[0] < rows:
+        dense_buffer = np.empty((rows, columns), dtype=dtype)
+        dense_buffers.shapes[(columns, dtype)] = dense_buffer
+    return dense_buffer[:rows]
+
+
+def densify(matrix):
+    '''
+    Writes a CSR matrix into the dense buffer of the current thread, for models taking dense inputs.
+    The buffer is overwritten by the next call in the same thread.
+
+    Args:
+        matrix (scipy.sparse.csr_matrix): one row per sample, without duplicate entries
+    Returns:
+        A C-contiguous numpy.ndarray with the shape and dtype of the matrix
+    '''
+    rows, columns = matrix.shape
+    dense_buffer = get_dense_buffer(rows, columns, matrix.dtype)
+    dense_buffer.fill(0)
+    row_indices = np.repeat(np.arange(rows), np.diff(matrix.indptr))
+    dense_buffer[row_indices, matrix.indices] = matrix.data
+    return dense_buffer
+
+
+def to_coo_tensors(input_):
+    '''
+    Returns:
+        The 'indices' (int64, [nnz, 2]), 'values' ([nnz]) and 'dense_shape' (int64, [2]) tensors
+        of a sparse matrix or dense array, the inputs of a TensorFlow SparseTensor
+    '''
+    if is_sparse(input_):
+        coo_matrix = input_.tocoo()
+        rows, columns, values = coo_matrix.row, coo_matrix.col, coo_matrix.data
+    else:
+        rows, columns = np.nonzero(input_)
+        values = input_[rows, columns]
+    indices = np.ascontiguousarray(np.stack([rows, columns], axis=1), dtype=np.int64)
+    return [indices,
+            np.ascontiguousarray(values),
+            np.array(input_.shape, dtype=np.int64)]
+
+
+def stack_inputs(inputs):
+    '''
+    Args:
+        inputs (list): arrays or sparse matrices of the same width, one row per sample
+    Returns:
+        A single CSR matrix when any input is sparse, or a single array otherwise
+    '''
+    if len(inputs) == 1:
+        return inputs[0]
+    if any(is_sparse(input_) for input_ in inputs):
+        import scipy.sparse
+
+        return scipy.sparse.vstack(inputs, format='csr')
+    return np.concatenate(inputs)
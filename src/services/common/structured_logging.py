@@ -0,0 +1,98 @@
+import logging.handlers
+
+import os
+import sys
+import json
+import queue
+import random
+import atexit
+import logging
+import tracing
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+
+# Share of records kept for high-volume events, as 'event=rate' pairs
+# Ex: LOG_SAMPLE_RATES=tensor_removed=0.01,request=0.1
+LOG_SAMPLE_RATES = {event.strip(): float(rate)
+                    for event, rate in (pair.split('=')
+                                        for pair in os.environ.get('LOG_SAMPLE_RATES', '').split(',')
+                                        if '=' in pair)}
+
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+
+# Attributes every LogRecord has; anything else was given through 'extra' and is written as a field
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message'}
+
+listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": record.created,
+                 "level": record.levelname,
+                 "service": tracing.SERVICE_NAME,
+                 "logger": record.name,
+                 "message": record.getMessage()}
+        entry.update({key: value
+                      for key, value in vars(record).items()
+                      if key not in RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+# Runs in the thread logging the record, before it is queued
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        event = getattr(record, 'event', None)
+        if event in LOG_SAMPLE_RATES and random.random() >= LOG_SAMPLE_RATES[event]:
+            return False
+        span = tracing.current_span.get()
+        if span is not None:
+            record.trace_id = span.trace_id
+            record.span_id = span.span_id
+        return True
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    '''
+    Queues records as they are, so messages are only formatted by the writer thread,
+    and drops records instead of blocking the caller when the writer falls behind.
+    '''
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def start_listener(handler):
+    global listener
+    handler.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(handler.queue, stream_handler)
+    listener.start()
+
+
+def setup_logging():
+    '''
+    Sends the records of every logger as JSON lines to stdout, through a background writer thread.
+    '''
+    root = logging.getLogger()
+    if any(isinstance(handler, BackgroundHandler) for handler in root.handlers):
+        return
+
+    handler = BackgroundHandler(None)
+    handler.addFilter(ContextFilter())
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+
+    start_listener(handler)
+    atexit.register(lambda: listener.stop())
+    # The writer thread does not survive a fork, so every (gunicorn) worker starts its own
+    os.register_at_fork(after_in_child=lambda: start_listener(handler))
@@ -0,0 +1,31 @@
+from redisai.utils import dtype_dict
+
+import numpy as np
+
+# numpy dtype holding each RedisAI tensor type. Descriptors name dtypes like redisai does
+# ('float' is FLOAT, i.e. float32), so names go through the redisai table first.
+TENSOR_TYPES = {"FLOAT": "float32",
+                "DOUBLE": "float64",
+                "INT8": "int8",
+                "INT16": "int16",
+                "INT32": "int32",
+                "INT64": "int64",
+                "UINT8": "uint8",
+                "UINT16": "uint16"}
+
+
+def to_numpy_dtype(name):
+    '''
+    Args:
+        name (string): the 'dtype' of an input in <model_name>.json
+            Ex: float
+    Returns:
+        The numpy.dtype sent to RedisAI as the tensor type redisai uses for that name
+    Raises:
+        ValueError: RedisAI has no tensor type for the name
+    '''
+    tensor_type = dtype_dict.get(name)
+    if tensor_type not in TENSOR_TYPES:
+        raise ValueError("Input dtype '" + str(name) + "' is not supported. Use one of: " +
+                         ", ".join(sorted(dtype for dtype in dtype_dict if dtype_dict[dtype] in TENSOR_TYPES)))
+    return np.dtype(TENSOR_TYPES[tensor_type])
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Shared modules are imported by name, as in the containers they are copied into
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
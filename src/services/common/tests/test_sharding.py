@@ -0,0 +1,88 @@
+import pytest
+
+import sharding
+
+
+def place_keys(ring, keys):
+    return {key: ring.get_nodes(key)[0] for key in keys}
+
+
+KEYS = ['model_' + str(i) + '/1' for i in range(2000)]
+
+
+def test_get_nodes_returns_distinct_replicas():
+    ring = sharding.HashRing(['n0:6379', 'n1:6379', 'n2:6379'])
+
+    for key in KEYS[:200]:
+        nodes = ring.get_nodes(key, 2)
+        assert len(nodes) == 2
+        assert len(set(nodes)) == 2
+
+
+def test_get_nodes_never_returns_more_nodes_than_the_ring_has():
+    ring = sharding.HashRing(['n0:6379', 'n1:6379'])
+
+    assert sorted(ring.get_nodes('iris/1', 5)) == ['n0:6379', 'n1:6379']
+
+
+def test_placement_is_stable():
+    nodes = ['n0:6379', 'n1:6379', 'n2:6379']
+
+    assert place_keys(sharding.HashRing(nodes), KEYS) == place_keys(sharding.HashRing(list(reversed(nodes))), KEYS)
+
+
+def test_adding_a_node_only_moves_keys_to_it():
+    before = place_keys(sharding.HashRing(['n0:6379', 'n1:6379', 'n2:6379']), KEYS)
+    after = place_keys(sharding.HashRing(['n0:6379', 'n1:6379', 'n2:6379', 'n3:6379']), KEYS)
+
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(after[key] == 'n3:6379' for key in moved)
+    # About a quarter of the keys belong to the new node
+    assert 0.15 < len(moved) / len(KEYS) < 0.35
+
+
+def test_removing_a_node_only_moves_its_keys():
+    before = place_keys(sharding.HashRing(['n0:6379', 'n1:6379', 'n2:6379']), KEYS)
+    after = place_keys(sharding.HashRing(['n0:6379', 'n2:6379']), KEYS)
+
+    for key in KEYS:
+        if before[key] != 'n1:6379':
+            assert after[key] == before[key]
+        else:
+            assert after[key] != 'n1:6379'
+
+
+class ControlClient:
+    def __init__(self, model_info):
+        self.model_info = model_info
+
+    def hget(self, key, field):
+        return self.model_info.get(key, {}).get(field)
+
+
+@pytest.fixture
+def nodes(monkeypatch):
+    nodes = ['n0:6379', 'n1:6379', 'n2:6379']
+    monkeypatch.setattr(sharding, 'ring', sharding.HashRing(nodes))
+    monkeypatch.setattr(sharding, 'clients', {node: node for node in nodes})
+    monkeypatch.setattr(sharding, 'holders_cache', {})
+    return nodes
+
+
+def test_get_holders_prefers_the_nodes_recorded_by_model_add(nodes, monkeypatch):
+    assigned = sharding.model_nodes('iris/1')
+    previous = [node for node in nodes if node not in assigned][:1]
+    monkeypatch.setattr(sharding, 'control_client',
+                        ControlClient({'model_info:iris/1': {'nodes': ','.join(previous).encode('utf-8')}}))
+
+    assert sharding.get_holders('iris/1') == previous
+    assert sharding.model_client('iris/1') == previous[0]
+
+
+def test_get_holders_falls_back_to_the_ring(nodes, monkeypatch):
+    monkeypatch.setattr(sharding, 'control_client',
+                        ControlClient({'model_info:iris/2': {'nodes': b'removed:6379'}}))
+
+    assert sharding.get_holders('iris/1') == sharding.model_nodes('iris/1')
+    # Nodes no longer in REDISAI_NODES are ignored
+    assert sharding.get_holders('iris/2') == sharding.model_nodes('iris/2')
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+import sparse_input
+
+scipy_sparse = pytest.importorskip('scipy.sparse')
+
+
+def test_densify_matches_toarray():
+    matrix = scipy_sparse.random(5, 7, density=0.3, format='csr', random_state=0)
+
+    np.testing.assert_array_equal(sparse_input.densify(matrix), matrix.toarray())
+
+
+def test_densify_clears_the_reused_buffer():
+    sparse_input.densify(scipy_sparse.csr_matrix(np.ones((3, 4))))
+    dense = sparse_input.densify(scipy_sparse.csr_matrix(([2.0], ([1], [2])), shape=(2, 4)))
+
+    np.testing.assert_array_equal(dense, [[0, 0, 0, 0], [0, 0, 2, 0]])
+
+
+def test_sparse_and_dense_inputs_give_the_same_coo_tensors():
+    dense = np.array([[0, 1.5, 0], [2.5, 0, 0]], dtype=np.float32)
+
+    for input_ in (dense, scipy_sparse.csr_matrix(dense)):
+        indices, values, dense_shape = sparse_input.to_coo_tensors(input_)
+
+        np.testing.assert_array_equal(indices, [[0, 1], [1, 0]])
+        np.testing.assert_array_equal(values, [1.5, 2.5])
+        np.testing.assert_array_equal(dense_shape, [2, 3])
+        assert indices.dtype == np.int64 and dense_shape.dtype == np.int64
+        assert values.dtype == np.float32
+
+
+def test_stack_inputs_keeps_dense_inputs_dense():
+    stacked = sparse_input.stack_inputs([np.zeros((1, 3)), np.ones((2, 3))])
+
+    assert isinstance(stacked, np.ndarray)
+    assert stacked.shape == (3, 3)
+
+
+def test_stack_inputs_with_a_sparse_input_gives_csr():
+    stacked = sparse_input.stack_inputs([np.ones((1, 3)), scipy_sparse.csr_matrix(np.eye(3))])
+
+    assert stacked.format == 'csr'
+    np.testing.assert_array_equal(stacked.toarray(), np.vstack([np.ones((1, 3)), np.eye(3)]))
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+import tensor_types
+
+
+@pytest.mark.parametrize('name, dtype', [
+    ('float', np.float32),
+    ('float32', np.float32),
+    ('double', np.float64),
+    ('float64', np.float64),
+    ('int64', np.int64),
+    ('uint8', np.uint8),
+])
+def test_to_numpy_dtype_follows_redisai_names(name, dtype):
+    assert tensor_types.to_numpy_dtype(name) == np.dtype(dtype)
+
+
+@pytest.mark.parametrize('name', ['str', 'complex64', 'float16', None])
+def test_to_numpy_dtype_rejects_types_redisai_can_not_hold(name):
+    with pytest.raises(ValueError, match="is not supported"):
+        tensor_types.to_numpy_dtype(name)
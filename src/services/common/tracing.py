@@ -0,0 +1,218 @@
+from contextlib import contextmanager
+
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import contextvars
+import urllib.request
+
+# 'none', 'file' (one JSON span per line in TRACE_FILE) or 'otlp' (OTLP/HTTP JSON to TRACE_OTLP_ENDPOINT)
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'none')
+
+TRACE_FILE = os.environ.get('TRACE_FILE', '/tmp/traces.ndjson')
+
+TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+
+# Share of new traces recorded. Services receiving a trace follow the decision of the caller.
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.1'))
+
+# Every service works inside a folder with its own name (/inference, /model_add...)
+SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', os.path.basename(os.getcwd()))
+
+# Separates a queue payload ('iris/1', tensor names...) from its 'traceparent'
+PAYLOAD_SEPARATOR = '|'
+
+logger = logging.getLogger(__name__)
+
+current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, sampled):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = {}
+        self.start = time.time_ns()
+        self.end = None
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def traceparent(self):
+        return '00-' + self.trace_id + '-' + self.span_id + ('-01' if self.sampled else '-00')
+
+
+# Only the ids and the sampling decision of a span started elsewhere (another service or queue)
+class RemoteSpan:
+    def __init__(self, trace_id, span_id, sampled):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+
+def parse_traceparent(traceparent):
+    '''
+    Args:
+        traceparent (string): a W3C 'traceparent' value
+            Ex: 00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01
+    Returns:
+        A RemoteSpan, or None if the value is missing or invalid
+    '''
+    if not traceparent:
+        return None
+    parts = traceparent.strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return RemoteSpan(parts[1], parts[2], parts[3] == '01')
+
+
+def start_span(name, parent=None):
+    '''
+    Starts a span as a child of 'parent', or of the current span when 'parent' is None.
+    Without any of both, a new trace is started and sampled with TRACE_SAMPLE_RATE.
+
+    Returns:
+        A tuple with the span and the token needed by 'end_span'
+    '''
+    parent = parent or current_span.get()
+    if parent is None:
+        span = Span(name,
+                    '%032x' % random.getrandbits(128),
+                    None,
+                    TRACE_EXPORTER != 'none' and random.random() < TRACE_SAMPLE_RATE)
+    else:
+        span = Span(name, parent.trace_id, parent.span_id, parent.sampled)
+    return span, current_span.set(span)
+
+
+def end_span(span, token, error=None):
+    current_span.reset(token)
+    if not span.sampled:
+        return
+    span.end = time.time_ns()
+    if error is not None:
+        span.error = str(error)
+    export_span(span)
+
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    started_span, token = start_span(name, parent)
+    started_span.attributes.update(attributes)
+    try:
+        yield started_span
+    except Exception as err:
+        end_span(started_span, token, err)
+        raise
+    end_span(started_span, token)
+
+
+def inject(payload):
+    '''
+    Appends the current trace to a queue payload, so the consumer continues the same trace.
+
+    Args:
+        payload (string): the queue payload
+            Ex: iris/1
+    Returns:
+        The payload followed by the current 'traceparent', or the payload alone outside a span
+    '''
+    active_span = current_span.get()
+    if active_span is None:
+        return payload
+    return payload + PAYLOAD_SEPARATOR + active_span.traceparent
+
+
+def extract(payload):
+    '''
+    Returns:
+        A tuple with the original payload and the RemoteSpan it was sent from (or None)
+    '''
+    payload, _, traceparent = payload.partition(PAYLOAD_SEPARATOR)
+    return payload, parse_traceparent(traceparent)
+
+
+# Spans are handed to a background thread, so exporting never blocks a request
+spans_queue = queue.Queue(maxsize=10000)
+exporter_pid = None
+
+
+def export_span(span):
+    global exporter_pid
+    # The exporter thread does not survive a fork, so every (gunicorn) worker starts its own
+    if exporter_pid != os.getpid():
+        exporter_pid = os.getpid()
+        threading.Thread(target=export_spans, daemon=True).start()
+    try:
+        spans_queue.put_nowait(span)
+    except queue.Full:
+        pass
+
+
+def export_spans():
+    while True:
+        spans = [spans_queue.get()]
+        time.sleep(1)
+        while not spans_queue.empty() and len(spans) < 512:
+            spans.append(spans_queue.get_nowait())
+        try:
+            if TRACE_EXPORTER == 'file':
+                write_spans(spans)
+            elif TRACE_EXPORTER == 'otlp':
+                send_spans(spans)
+        except Exception as err:
+            logger.error("%d spans could not be exported", len(spans),
+                         extra={"event": "trace_export_error", "error": str(err)})
+
+
+def write_spans(spans):
+    with open(TRACE_FILE, 'a') as trace_file:
+        for span in spans:
+            trace_file.write(json.dumps({"service": SERVICE_NAME,
+                                         "name": span.name,
+                                         "trace_id": span.trace_id,
+                                         "span_id": span.span_id,
+                                         "parent_id": span.parent_id,
+                                         "start": span.start,
+                                         "duration_ms": (span.end - span.start) / 1e6,
+                                         "attributes": span.attributes,
+                                         "error": span.error}) + "\n")
+
+
+def to_otlp_attributes(attributes):
+    return [{"key": key, "value": {"stringValue": str(value)}}
+            for key, value in attributes.items()]
+
+
+def send_spans(spans):
+    otlp_spans = []
+    for span in spans:
+        otlp_span = {"traceId": span.trace_id,
+                     "spanId": span.span_id,
+                     "name": span.name,
+                     "kind": 1,
+                     "startTimeUnixNano": str(span.start),
+                     "endTimeUnixNano": str(span.end),
+                     "attributes": to_otlp_attributes(span.attributes)}
+        if span.parent_id:
+            otlp_span['parentSpanId'] = span.parent_id
+        if span.error:
+            otlp_span['status'] = {"code": 2, "message": span.error}
+        otlp_spans.append(otlp_span)
+
+    body = {"resourceSpans": [{"resource": {"attributes": to_otlp_attributes({"service.name": SERVICE_NAME})},
+                               "scopeSpans": [{"scope": {"name": "ai-inference"},
+                                               "spans": otlp_spans}]}]}
+    otlp_request = urllib.request.Request(TRACE_OTLP_ENDPOINT,
+                                          data=json.dumps(body).encode('utf-8'),
+                                          headers={"Content-Type": "application/json"})
+    urllib.request.urlopen(otlp_request, timeout=5).close()
@@ -0,0 +1,139 @@
+import os
+import stat
+import shutil
+import hashlib
+import logging
+
+MODELS_PATH = os.environ['MODELS_ROOT_PATH']
+
+# Hidden folder inside MODELS_ROOT_PATH, so objects and version folders share the same
+# filesystem and can be hard linked
+STORE_PATH = os.path.join(MODELS_PATH, '.store')
+
+CHUNK_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def object_path(file_hash):
+    return os.path.join(STORE_PATH, file_hash[:2], file_hash)
+
+
+def store_file(path):
+    '''
+    Replaces a file by a hard link to its content-addressed object, creating the object
+    from the file itself if its content was never stored before.
+
+    Args:
+        path (string): the file to store
+            Ex: /models/imagenet/2/utils/data/imagenet_classes.json
+    Returns:
+        True if the content was already stored (the file was deduplicated), False otherwise
+    '''
+    stored_path = object_path(hash_file(path))
+
+    if not os.path.isfile(stored_path):
+        os.makedirs(os.path.dirname(stored_path), exist_ok=True)
+        try:
+            os.link(path, stored_path)
+            # Objects are shared between versions, so nobody may change them in place
+            os.chmod(stored_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            return False
+        except FileExistsError:
+            # Same content stored meanwhile by another import thread
+            pass
+
+    if not os.path.samefile(path, stored_path):
+        temporary_path = path + '.link'
+        os.link(stored_path, temporary_path)
+        os.replace(temporary_path, path)
+    return True
+
+
+def store_model_files(model_version_path):
+    '''
+    Deduplicates every file of a model version folder against the store.
+
+    Args:
+        model_version_path (string): the folder of the model version
+            Ex: /models/imagenet/2
+    Returns:
+        A tuple with the number of files and the number of deduplicated files
+    '''
+    files, deduplicated = 0, 0
+    for folder, _, file_names in os.walk(model_version_path):
+        for file_name in file_names:
+            path = os.path.join(folder, file_name)
+            if os.path.islink(path):
+                continue
+            try:
+                deduplicated += store_file(path)
+            except OSError as err:
+                # Filesystems without hard links keep the plain copy
+                logger.error("File '%s' could not be stored", path,
+                             extra={"event": "store_error", "path": path, "error": str(err)})
+            files += 1
+    return files, deduplicated
+
+
+def remove_model_files(path):
+    '''
+    Deletes a model (or model version) folder and the objects no other version links.
+    Only the files of the folder are hashed, so the store is never walked on a delete.
+
+    Args:
+        path (string): the folder to delete
+            Ex: /models/imagenet/2
+    Returns:
+        The number of objects removed from the store
+    '''
+    candidates = set()
+    for folder, _, file_names in os.walk(path):
+        for file_name in file_names:
+            file_path = os.path.join(folder, file_name)
+            # Linked by this folder and its object only
+            if not os.path.islink(file_path) and os.stat(file_path).st_nlink == 2:
+                candidates.add(object_path(hash_file(file_path)))
+
+    shutil.rmtree(path)
+
+    removed = 0
+    for stored_path in candidates:
+        try:
+            # Checked again, since an import may have linked the object meanwhile
+            if os.stat(stored_path).st_nlink == 1:
+                os.remove(stored_path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+# Removes objects no longer linked by any model version folder, walking the whole store.
+# Deletes already remove their own objects (see 'remove_model_files'), so this is only a
+# maintenance command for objects left behind by an interrupted delete or import.
+def collect_unused_files():
+    removed = 0
+    if not os.path.exists(STORE_PATH):
+        return removed
+
+    for folder, _, file_names in os.walk(STORE_PATH):
+        for file_name in file_names:
+            path = os.path.join(folder, file_name)
+            if os.stat(path).st_nlink == 1:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+if __name__ == "__main__":
+    removed = collect_unused_files()
+    print(str(removed) + " unused objects removed from '" + STORE_PATH + "'")
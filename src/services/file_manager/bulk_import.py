@@ -0,0 +1,212 @@
+from schemas.file_schema import file_validator, model_extensions
+from artifact_store import store_model_files, remove_model_files
+
+from concurrent.futures import ThreadPoolExecutor
+from jsonschema import exceptions
+
+import os
+import sys
+import json
+import shutil
+import tarfile
+import argparse
+import tempfile
+import logging
+import tracing
+
+MODELS_PATH = os.environ['MODELS_ROOT_PATH']
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveError(ValueError):
+    '''
+    The file to import is not a tarball, or holds members outside the extraction folder.
+    '''
+
+
+# A version folder holds '<model_name>.json' next to '<model_name>.<extension>'.
+# This matches both '<model_name>/<model_version>/' trees and the 'samples/' layout,
+# and avoids parsing other JSON files shipped with the models (datasets, class names...).
+def find_model_folders(source_path):
+    extensions = set(model_extensions.values())
+    model_folders = []
+    for folder, sub_folders, file_names in os.walk(source_path):
+        for file_name in file_names:
+            stem, extension = os.path.splitext(file_name)
+            if extension == '.json' and any(stem + '.' + model_extension in file_names
+                                            for model_extension in extensions):
+                model_folders.append((folder, stem))
+                # Version folders are copied as a whole, nothing to look for inside them
+                sub_folders.clear()
+                break
+    model_folders.sort()
+    return model_folders
+
+
+def validate_model_folder(folder, json_name):
+    '''
+    Applies the same checks as 'validate_model_files' to a folder outside MODELS_ROOT_PATH.
+
+    Args:
+        folder (string): the version folder to validate
+        json_name (string): the name of the JSON file, without extension
+    Returns:
+        A report dict with 'source', 'model', 'version' and, if the folder is invalid,
+        'status' set to 'invalid' and a 'message'
+    '''
+    report = {"source": folder, "model": json_name, "version": None}
+    try:
+        with open(os.path.join(folder, json_name + '.json')) as json_file:
+            model_data = json.load(json_file)
+        file_validator.validate(model_data)
+        model = model_data['model']
+        report['version'] = str(model['version'])
+
+        if model['name'] != json_name:
+            message = "Model name '" + model['name'] + "' is different than JSON file name '" + json_name + "'"
+        elif not os.path.isfile(os.path.join(folder, json_name + '.' + model_extensions[model['backend']['type']])):
+            message = "'" + json_name + '.' + model_extensions[model['backend']['type']] + \
+                "' using backend '" + model['backend']['type'] + "' not found"
+        elif not os.path.isfile(os.path.join(folder, model['script']['folder'], 'formatter.py')):
+            message = "'formatter.py' not found in folder '" + model['script']['folder'] + "'"
+        elif model.get('warmup', {}).get('sample') and \
+                not os.path.isfile(os.path.join(folder, model['warmup']['sample'])):
+            message = "Warm-up sample '" + model['warmup']['sample'] + "' not found"
+        else:
+            return report
+
+    except exceptions.ValidationError as err:
+        message = err.message
+    except json.decoder.JSONDecodeError:
+        message = "JSON is invalid. Please, validate your JSON file"
+    except OSError as err:
+        message = str(err)
+
+    report.update(status="invalid", message=message)
+    return report
+
+
+def copy_model_folder(report, overwrite):
+    destination_path = os.path.join(MODELS_PATH, report['model'], report['version'])
+    try:
+        if os.path.exists(destination_path):
+            if not overwrite:
+                report.update(status="exists",
+                              message="Version already exists. Use 'overwrite' to replace it")
+                return report
+            # Objects only the replaced version linked are removed with it
+            remove_model_files(destination_path)
+
+        shutil.copytree(report['source'], destination_path)
+        store_model_files(destination_path)
+        report.update(status="imported")
+    except OSError as err:
+        report.update(status="failed", message=str(err))
+    return report
+
+
+# Only regular files and folders are extracted. Links, devices and FIFOs are skipped,
+# since model versions never need them.
+def extract_archive(archive_path, destination_path):
+    try:
+        with tarfile.open(archive_path) as archive:
+            root = os.path.realpath(destination_path)
+            members = []
+            for member in archive.getmembers():
+                member_path = os.path.realpath(os.path.join(destination_path, member.name))
+                if os.path.commonpath([root, member_path]) != root:
+                    raise ArchiveError("Archive member '" + member.name + "' is outside the archive")
+                if member.isfile() or member.isdir():
+                    members.append(member)
+                else:
+                    logger.warning("Archive member '%s' is not a file or folder. Skipping it.", member.name,
+                                   extra={"event": "import_skipped", "path": archive_path, "member": member.name})
+            archive.extractall(destination_path, members=members)
+    except tarfile.TarError as err:
+        raise ArchiveError("'" + archive_path + "' is not a valid tarball: " + str(err))
+
+
+def import_models(redis_client, source_path, overwrite=False):
+    '''
+    Imports every model version found in a local folder or tarball.
+    Versions are validated and copied by a thread pool, then all valid versions are
+    registered with a single push to 'models_to_add', in import order. JSON parsing and
+    schema validation hold the GIL, so the threads only overlap the file reads and copies.
+
+    Args:
+        redis_client (redisai.Client): client used to register the imported versions
+        source_path (string): a folder or a tarball ('.tar', '.tar.gz'...)
+            Ex: /path/to/samples
+        overwrite (bool): if existing versions should be replaced
+    Returns:
+        A list with one report dict per version found
+    Raises:
+        ArchiveError: 'source_path' is a file but not a valid tarball
+    '''
+    with tempfile.TemporaryDirectory() as extracted_path:
+        if os.path.isfile(source_path):
+            extract_archive(source_path, extracted_path)
+            model_folders = find_model_folders(extracted_path)
+        else:
+            model_folders = find_model_folders(source_path)
+
+        with ThreadPoolExecutor() as executor:
+            with tracing.span('validate', versions=len(model_folders)):
+                reports = list(executor.map(lambda model_folder: validate_model_folder(*model_folder),
+                                            model_folders))
+
+            to_copy = []
+            found = set()
+            for report in reports:
+                if 'status' in report:
+                    continue
+                model = (report['model'], report['version'])
+                if model in found:
+                    report.update(status="invalid",
+                                  message="Version found more than once in the import")
+                    continue
+                found.add(model)
+                to_copy.append(report)
+
+            with tracing.span('copy', versions=len(to_copy)):
+                list(executor.map(lambda report: copy_model_folder(report, overwrite), to_copy))
+
+    imported = [report['model'] + '/' + report['version']
+                for report in reports
+                if report['status'] == 'imported']
+    if imported:
+        # 'blpop' takes from the head, so the versions are pushed to the tail to be added in order
+        redis_client.rpush('models_to_add', *[tracing.inject(model) for model in imported])
+
+    logger.info("%d of %d model versions imported from '%s'", len(imported), len(reports), source_path,
+                extra={"event": "import", "imported": len(imported), "versions": len(reports), "path": source_path})
+    return reports
+
+
+if __name__ == "__main__":
+    import redisai
+    import structured_logging
+
+    structured_logging.setup_logging()
+
+    parser = argparse.ArgumentParser(
+        description="Imports many model versions from a folder or tarball")
+    parser.add_argument('path',
+                        help="folder or tarball holding the model versions")
+    parser.add_argument('--overwrite', action='store_true',
+                        help="replace versions that already exist")
+    parser.add_argument('--host', default='redisai',
+                        help="RedisAI host used to register the versions")
+    parser.add_argument('--port', default=6379, type=int,
+                        help="RedisAI port used to register the versions")
+    args = parser.parse_args()
+
+    try:
+        reports = import_models(redisai.Client(host=args.host, port=args.port),
+                                args.path,
+                                args.overwrite)
+    except ArchiveError as err:
+        sys.exit(str(err))
+    json.dump(reports, sys.stdout, indent=2)
+    sys.exit(0 if all(report['status'] == 'imported' for report in reports) else 1)
@@ -1,44 +1,91 @@
 from schemas.create_request_schema import create_request_schema
-from schemas.file_schema import file_schema
+from schemas.import_request_schema import import_request_schema
+from schemas.file_schema import file_validator, model_extensions
+from artifact_store import store_model_files, remove_model_files
+from bulk_import import import_models, ArchiveError
 
 from jsonschema import validate, exceptions
 
-from flask import Flask, jsonify, request
+from flask import Flask, g, jsonify, request
 
 from stringcase import snakecase
 
 import os
 import json
 import gdown
-import shutil
-import redisai
+import time
 import logging
+import tracing
+import sharding
+import structured_logging
 import threading
+import contextvars
 
 MODELS_PATH = os.environ['MODELS_ROOT_PATH']  # 'models'
 
-logging.basicConfig(format='%(message)s', level=logging.INFO)
+structured_logging.setup_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-redis_client = redisai.Client(host='redisai', port=6379)
+# Queues and model status live on the first RedisAI node
+redis_client = sharding.control_client
 
-model_extensions = {"tensorflow": "pb",
-                    "spark": "onnx",
-                    "sklearn": "onnx",
-                    "pytorch": "pt",
-                    "onnx": "onnx"}
+
+# Every request is a span, continuing the trace of the caller when a 'traceparent' header is sent
+@app.before_request
+def start_request_span():
+    g.request_start = time.perf_counter()
+    g.request_span = tracing.start_span(request.method + ' ' + str(request.url_rule),
+                                        tracing.parse_traceparent(request.headers.get('traceparent')))
+
+
+@app.after_request
+def add_traceparent(response):
+    request_span, _ = g.request_span
+    request_span.set('http.status_code', response.status_code)
+    response.headers['traceparent'] = request_span.traceparent
+    g.status_code = response.status_code
+    return response
+
+
+@app.teardown_request
+def end_request_span(error):
+    if 'request_span' in g:
+        tracing.end_span(*g.request_span, error)
+    if 'request_start' in g:
+        view_args = request.view_args or {}
+        logger.info("%s %s %s",
+                    request.method,
+                    request.path,
+                    g.get('status_code', 500),
+                    extra={"event": "request",
+                           "model": view_args.get('model_name', ''),
+                           "status": g.get('status_code', 500),
+                           "duration_ms": round((time.perf_counter() - g.request_start) * 1000, 3)})
 
 
 def register_model(model_name, model_version):
     redis_client.lpush('models_to_add',
-                       model_name + "/" + str(model_version))
+                       tracing.inject(model_name + "/" + str(model_version)))
+
+
+# Links identical files of every version to a single copy in the artifact store
+def store_model_version(model_name, model_version):
+    model_version_path = os.path.join(MODELS_PATH, model_name, str(model_version))
+    with tracing.span('store'):
+        files, deduplicated = store_model_files(model_version_path)
+    logger.info("Files for model '%s/%s' stored: %d of %d files deduplicated",
+                model_name, model_version, deduplicated, files,
+                extra={"event": "model_stored",
+                       "model": model_name + "/" + str(model_version),
+                       "files": files,
+                       "deduplicated": deduplicated})
 
 
 def unregister_model(model_name, model_version):
     redis_client.lpush('models_to_delete',
-                       model_name + "/" + str(model_version))
+                       tracing.inject(model_name + "/" + str(model_version)))
 
 
 # Downloads a .zip file from Google Drive using gdown
@@ -55,51 +102,57 @@ def download_zip_file(url, model_name, model_path, model_version=None):
     # file = requests.get(url, stream=True)
     with app.app_context():
         destination_path = os.path.join(model_path, model_name)
-        try:
-            logger.info("Downloading .zip file for model '" +
-                        model_name + "'...")
-            gdown.download(url, destination_path + ".zip", quiet=False)
-            logger.info("Extracting files for model '" + model_name + "'...")
-            gdown.extractall(destination_path + ".zip", model_path)
-            logger.info("Removing .zip file for model '" + model_name + "'...")
-            os.remove(destination_path + ".zip")
-
-        except OSError as err:
-            logger.error(".zip file removal failed")
-            return False, str(err)
-
-        except Exception as err:
-            logger.error(str(err))
-            return False, str(err)
-
-        logger.info("Files for model '" +
-                    model_name + "' downloaded end extracted sucessfully")
+        with tracing.span('download', model=model_name):
+            try:
+                logger.debug("Downloading .zip file for model '%s'...", model_name,
+                             extra={"event": "download", "model": model_name})
+                gdown.download(url, destination_path + ".zip", quiet=False)
+                logger.debug("Extracting files for model '%s'...", model_name,
+                             extra={"event": "extract", "model": model_name})
+                gdown.extractall(destination_path + ".zip", model_path)
+                os.remove(destination_path + ".zip")
+
+            except OSError as err:
+                logger.error(".zip file removal failed",
+                             extra={"event": "download_error", "model": model_name, "error": str(err)})
+                return False, str(err)
+
+            except Exception as err:
+                logger.error("Download of model '%s' failed", model_name,
+                             extra={"event": "download_error", "model": model_name, "error": str(err)})
+                return False, str(err)
+
+        logger.info("Files for model '%s' downloaded end extracted sucessfully", model_name,
+                    extra={"event": "downloaded", "model": model_name})
 
         if model_version:
-            is_validated, status_code = validate_model_files(model_name,
-                                                             model_version)
+            with tracing.span('validate'):
+                is_validated, status_code = validate_model_files(model_name,
+                                                                 model_version)
             if status_code == 200:
+                store_model_version(model_name, model_version)
                 register_model(model_name, model_version)
-                logger.info("Model '" + model_name + "/" +
-                            model_version + "' triggered to Redis")
+                logger.info("Model '%s/%s' triggered to Redis", model_name, model_version,
+                            extra={"event": "registered", "model": model_name + "/" + model_version})
             else:
                 delete_model_version_thread(model_name, model_version)
-                logger.error("Download request for model '" + model_name + "' version '" +
-                             model_version + "' failed. Model validation failed.")
+                logger.error("Download request for model '%s' version '%s' failed. Model validation failed.",
+                             model_name, model_version,
+                             extra={"event": "validation_error", "model": model_name + "/" + model_version})
                 return False, is_validated
 
         return True, "Files for model '" + model_name + "' downloaded end extracted sucessfully"
 
 
 def delete_folder(path):
-    shutil.rmtree(path)
+    remove_model_files(path)
 
 
 @app.route('/models/', methods=['GET'])
 def get_models():
     models = [model.name
               for model in os.scandir(MODELS_PATH)
-              if model.is_dir()]
+              if model.is_dir() and not model.name.startswith('.')]
     # Showing models in order...
     models.sort()
 
@@ -148,10 +201,10 @@ def validate_model_files(model_name, model_version):
             if os.path.isfile(json_path):
                 with open(json_path) as json_file:
                     model_data = json.load(json_file)
-                    validate(model_data, file_schema)
+                    file_validator.validate(model_data)
 
-                    logger.info("'" + model_name + ".json' for model '" +
-                                model_name + "' is valid")
+                    logger.debug("'%s.json' for model '%s' is valid", model_name, model_name,
+                                 extra={"event": "validated", "model": model_name})
 
                     model = model_data['model']
 
@@ -194,6 +247,12 @@ def validate_model_files(model_name, model_version):
                             model_name, model_version)
                         return jsonify(error="Not Found",
                                        message="Folder '" + model['script']['folder'] + "' for model '" + model_name + '/' + model_version + "' not found"), 404
+
+                    # model_add loads it after the model is set in RedisAI
+                    warmup_sample = model.get('warmup', {}).get('sample')
+                    if warmup_sample and not os.path.isfile(os.path.join(model_path, warmup_sample)):
+                        return jsonify(error="Not Found",
+                                       message="Warm-up sample '" + warmup_sample + "' for model '" + model_name + '/' + model_version + "' not found"), 404
             else:
 
                 return jsonify(error="Not Found",
@@ -203,16 +262,16 @@ def validate_model_files(model_name, model_version):
             return jsonify(error="Not Found",
                            message="Model not found"), 404
     except OSError as err:
-        logger.error(str(err))
+        logger.error("%s", err, extra={"event": "request_error", "error": str(err)})
         return jsonify(error="Internal Server Error",
                        message=str(err)), 500
     except exceptions.ValidationError as err:
-        logger.error(str(err))
+        logger.error("%s", err, extra={"event": "request_error", "error": str(err)})
         return jsonify(error="Validation Error",
                        message=err.message), 400
 
     except json.decoder.JSONDecodeError as err:
-        logger.error(str(err))
+        logger.error("%s", err, extra={"event": "request_error", "error": str(err)})
         return jsonify(error="JSONDecodeError",
                        message="JSON is invalid. Please, validate your JSON file"), 400
 
@@ -241,9 +300,11 @@ def create_model():
         os.makedirs(model_path)
 
         if is_async_request:
+            # The thread runs in a copy of the current context, so its spans belong to the request trace
             x = threading.Thread(name=model_name,
-                                 target=download_zip_file,
-                                 args=(model_url,
+                                 target=contextvars.copy_context().run,
+                                 args=(download_zip_file,
+                                       model_url,
                                        model_name,
                                        model_path,
                                        str(model_version)))
@@ -257,6 +318,7 @@ def create_model():
                                                       str(model_version))
 
         if status_code == 200:
+            store_model_version(model_name, model_version)
             register_model(model_name, model_version)
         else:
             delete_model_version_thread(model_name, str(model_version))
@@ -272,6 +334,40 @@ def create_model():
                        message=err.message), 400
 
 
+# Imports many model versions at once from a folder or tarball reachable by this service
+@app.route('/models/import', methods=['POST'])
+def import_model_versions():
+    try:
+        import_request_data = request.get_json(force=True)
+
+        validate(import_request_data, import_request_schema)
+
+        if not os.path.exists(import_request_data['path']):
+            return jsonify(error="Not Found",
+                           message="Path '" + import_request_data['path'] + "' not found"), 404
+
+        reports = import_models(redis_client,
+                                import_request_data['path'],
+                                import_request_data.get('overwrite', False))
+
+    except ArchiveError as err:
+        return jsonify(error="Bad Request",
+                       message=str(err)), 400
+
+    except OSError as err:
+        logger.error("%s", err, extra={"event": "request_error", "error": str(err)})
+        return jsonify(error="Internal Server Error",
+                       message="Model import failed", details=str(err)), 500
+
+    except exceptions.ValidationError as err:
+        return jsonify(error="Validation Error",
+                       message=err.message), 400
+
+    imported = len([report for report in reports if report['status'] == 'imported'])
+    return jsonify(message=str(imported) + " of " + str(len(reports)) + " model versions imported",
+                   versions=reports), 200
+
+
 @ app.route('/models/<model_name>', methods=['DELETE'])
 def delete_model(model_name):
     model_path = os.path.join(MODELS_PATH, model_name)
@@ -321,8 +417,9 @@ def delete_model_version(model_name, model_version):
 
 def delete_model_version_thread(model_name, model_version):
     delete_thread = threading.Thread(name=delete_model_version,
-                                     target=delete_model_version,
-                                     args=(model_name,
+                                     target=contextvars.copy_context().run,
+                                     args=(delete_model_version,
+                                           model_name,
                                            str(model_version)),)
     delete_thread.start()
 
@@ -364,12 +461,29 @@ def update_model_version():
     return jsonify(message="Model '" + model_name + "' version '" + str(model_version) + "' is updated and ready to go"), 200
 
 
-# To-Do
-'''
-@ app.route('/models/<model_name>/<version>', methods=['GET'])
-def get_model_version_details(model_name, version):
-    return jsonify(id=id,
-                   app='file_manager',
-                   host=os.uname()[1],
-                   worker=os.getpid())
-'''
+@app.route('/models/<model_name>/<model_version>', methods=['GET'])
+def get_model_version_details(model_name, model_version):
+    model_version_path = os.path.join(MODELS_PATH, model_name, model_version)
+    if not os.path.exists(model_version_path):
+        return jsonify(error="Not Found",
+                       message="Model or version not found"), 404
+
+    files = [file for file in os.listdir(model_version_path)]
+
+    # Status, RedisAI nodes and warm-up latency profile per batch size, written by model_add
+    model_info = redis_client.hgetall('model_info:' + model_name + '/' + model_version)
+    model_info = {key.decode('utf-8'): value.decode('utf-8')
+                  for key, value in model_info.items()}
+
+    if 'profile' in model_info:
+        profile = json.loads(model_info['profile'])
+    else:
+        profile = None
+
+    return jsonify(model_name=model_name,
+                   version=model_version,
+                   files=files,
+                   status=model_info.get('status', 'not_registered'),
+                   nodes=model_info['nodes'].split(',') if model_info.get('nodes') else [],
+                   profile=profile,
+                   error=model_info.get('error'))
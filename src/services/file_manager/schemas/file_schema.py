@@ -1,3 +1,16 @@
+from jsonschema import Draft7Validator
+
+model_extensions = {"tensorflow": "pb",
+                    "spark": "onnx",
+                    "sklearn": "onnx",
+                    "pytorch": "pt",
+                    "onnx": "onnx"}
+
+# Input dtypes with a RedisAI tensor type, named like redisai does
+input_dtypes = ["float", "double", "float32", "float64",
+                "int8", "int16", "int32", "int64",
+                "uint8", "uint16"]
+
 file_schema = {
     "title": "JSON Schema for model description",
     "type": "object",
@@ -54,6 +67,16 @@ file_schema = {
                                                 },
                                                 "minItems": 1
                                             },
+                                            "size": {
+                                                "description": "The height and width input images are resized to before 'pre_process'",
+                                                "type": "array",
+                                                "items": {
+                                                    "type": "integer",
+                                                    "minimum": 1
+                                                },
+                                                "minItems": 2,
+                                                "maxItems": 2
+                                            },
                                         },
                                         "required": ["type", "labels"],
                                         "additionalProperties": False,
@@ -97,8 +120,9 @@ file_schema = {
                                                 "enum": ["image", "number", "text"]
                                             },
                                             "dtype": {
-                                                "description": "The data type of the input",
-                                                "type": "string"
+                                                "description": "The data type of the input, as named by redisai ('float' is float32)",
+                                                "type": "string",
+                                                "enum": input_dtypes
                                             },
                                             "shape": {
                                                 "description": "The size of the input",
@@ -108,6 +132,10 @@ file_schema = {
                                                 },
                                                 "minItems": 2
                                             },
+                                            "sparse": {
+                                                "description": "If the model takes the input as 'indices', 'values' and 'dense_shape' tensors",
+                                                "type": "boolean"
+                                            },
                                         },
                                         "required": ["type", "dtype", "shape"],
                                         "additionalProperties": False,
@@ -150,6 +178,58 @@ file_schema = {
                     "required": ["folder"],
                     "additionalProperties": False,
                 },
+                "replicas": {
+                    "description": "The number of RedisAI nodes holding the model, for models with many requests",
+                    "type": "integer",
+                    "minimum": 1
+                },
+                "batching": {
+                    "description": "Details of the batches inputs of concurrent requests are run in, for models with any batch size",
+                    "type": "object",
+                    "properties": {
+                        "max_batch_size": {
+                            "description": "The number of samples a batch is run at",
+                            "type": "integer",
+                            "minimum": 1
+                        },
+                        "max_wait_ms": {
+                            "description": "The milliseconds a request waits for others to join its batch",
+                            "type": "number",
+                            "minimum": 0
+                        },
+                    },
+                    "additionalProperties": False,
+                },
+                "warmup": {
+                    "description": "Details of the warm-up run after the model is registered in RedisAI",
+                    "type": "object",
+                    "properties": {
+                        "enabled": {
+                            "description": "If the model should be warmed up before it is marked as ready",
+                            "type": "boolean"
+                        },
+                        "batch_sizes": {
+                            "description": "The batch sizes to warm up and profile",
+                            "type": "array",
+                            "items": {
+                                "type": "integer",
+                                "minimum": 1
+                            },
+                            "minItems": 1
+                        },
+                        "iterations": {
+                            "description": "The number of measured runs for each batch size",
+                            "type": "integer",
+                            "minimum": 1
+                        },
+                        "sample": {
+                            "description": "A '.npy' file inside the model folder holding one pre-processed input",
+                            "type": "string",
+                            "minLength": 1
+                        },
+                    },
+                    "additionalProperties": False,
+                },
             },
             "required": ["name", "version", "backend", "script"],
             "additionalProperties": False,
@@ -158,3 +238,6 @@ file_schema = {
     "required": ["model"],
     "additionalProperties": False,
 }
+
+# Compiled once, so validating many model versions does not rebuild the schema checks every time
+file_validator = Draft7Validator(file_schema)
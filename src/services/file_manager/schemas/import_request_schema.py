@@ -0,0 +1,17 @@
+import_request_schema = {
+    "title": "JSON Schema for bulk import request",
+    "type": "object",
+    "properties": {
+        "path": {
+            "description": "Local folder or tarball holding '<model_name>/<model_version>/' folders",
+            "type": "string",
+            "minLength": 1,
+        },
+        "overwrite": {
+            "description": "If versions that already exist should be replaced",
+            "type": "boolean",
+        }
+    },
+    "required": ["path"],
+    "additionalProperties": False
+}
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+import artifact_store
+
+
+@pytest.fixture
+def models_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifact_store, 'STORE_PATH', str(tmp_path / '.store'))
+    return tmp_path
+
+
+def write_version(models_path, version, files):
+    version_path = models_path / 'iris' / version
+    for name, content in files.items():
+        (version_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (version_path / name).write_bytes(content)
+    return str(version_path)
+
+
+def test_store_model_files_links_same_content_once(models_path):
+    first = write_version(models_path, '1', {'iris.onnx': b'model', 'utils/formatter.py': b'code'})
+    second = write_version(models_path, '2', {'iris.onnx': b'model', 'utils/formatter.py': b'other code'})
+
+    assert artifact_store.store_model_files(first) == (2, 0)
+    assert artifact_store.store_model_files(second) == (2, 1)
+
+    stored_path = artifact_store.object_path(artifact_store.hash_file(os.path.join(first, 'iris.onnx')))
+    assert os.path.samefile(stored_path, os.path.join(second, 'iris.onnx'))
+    assert os.stat(stored_path).st_nlink == 3
+
+
+def test_store_file_is_idempotent(models_path):
+    version_path = write_version(models_path, '1', {'iris.onnx': b'model'})
+    artifact_store.store_model_files(version_path)
+
+    assert artifact_store.store_model_files(version_path) == (1, 1)
+    assert os.stat(os.path.join(version_path, 'iris.onnx')).st_nlink == 2
+
+
+def test_remove_model_files_keeps_objects_linked_by_other_versions(models_path):
+    first = write_version(models_path, '1', {'iris.onnx': b'model', 'utils/formatter.py': b'code'})
+    second = write_version(models_path, '2', {'iris.onnx': b'model'})
+    artifact_store.store_model_files(first)
+    artifact_store.store_model_files(second)
+    formatter_object = artifact_store.object_path(artifact_store.hash_file(os.path.join(first, 'utils', 'formatter.py')))
+
+    assert artifact_store.remove_model_files(first) == 1
+    assert not os.path.exists(first)
+    assert not os.path.exists(formatter_object)
+    assert artifact_store.store_model_files(second) == (1, 1)
+
+    assert artifact_store.remove_model_files(second) == 1
+    assert artifact_store.collect_unused_files() == 0
+
+
+def test_collect_unused_files_removes_objects_without_versions(models_path):
+    version_path = write_version(models_path, '1', {'iris.onnx': b'model'})
+    artifact_store.store_model_files(version_path)
+    os.remove(os.path.join(version_path, 'iris.onnx'))
+
+    assert artifact_store.collect_unused_files() == 1
+    assert artifact_store.collect_unused_files() == 0
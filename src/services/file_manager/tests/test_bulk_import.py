@@ -0,0 +1,122 @@
+import io
+import os
+import json
+import tarfile
+
+import pytest
+
+import artifact_store
+import bulk_import
+
+
+class QueueClient:
+    def __init__(self):
+        self.queues = {}
+
+    def rpush(self, key, *values):
+        self.queues.setdefault(key, []).extend(values)
+
+
+@pytest.fixture
+def models_path(tmp_path, monkeypatch):
+    models_path = tmp_path / 'models'
+    models_path.mkdir()
+    monkeypatch.setattr(bulk_import, 'MODELS_PATH', str(models_path))
+    monkeypatch.setattr(artifact_store, 'STORE_PATH', str(models_path / '.store'))
+    return models_path
+
+
+def write_sample(source_path, name, version, model_bytes):
+    folder = source_path / name
+    (folder / 'utils').mkdir(parents=True)
+    (folder / (name + '.onnx')).write_bytes(model_bytes)
+    (folder / 'utils' / 'formatter.py').write_text('def pre_process(input_):\n    return input_\n')
+    (folder / (name + '.json')).write_text(json.dumps({"model": {
+        "name": name,
+        "version": version,
+        "backend": {"type": "onnx",
+                    "parameters": {"input": {"type": "number", "dtype": "float", "shape": [1, 4]},
+                                   "output": {"shape": [1, 2]}}},
+        "script": {"folder": "utils"}}}))
+
+
+def test_import_models_registers_versions_in_import_order(tmp_path, models_path):
+    for name in ['a', 'b', 'c']:
+        write_sample(tmp_path / 'samples', name, 1, name.encode())
+    redis_client = QueueClient()
+
+    reports = bulk_import.import_models(redis_client, str(tmp_path / 'samples'))
+
+    assert [report['status'] for report in reports] == ['imported'] * 3
+    assert redis_client.queues['models_to_add'] == ['a/1', 'b/1', 'c/1']
+
+
+def test_overwrite_removes_objects_of_the_replaced_version(tmp_path, models_path):
+    write_sample(tmp_path / 'old', 'iris', 1, b'old model')
+    write_sample(tmp_path / 'new', 'iris', 1, b'new model')
+    bulk_import.import_models(QueueClient(), str(tmp_path / 'old'))
+    old_object = artifact_store.object_path(artifact_store.hash_file(str(models_path / 'iris' / '1' / 'iris.onnx')))
+
+    reports = bulk_import.import_models(QueueClient(), str(tmp_path / 'new'), overwrite=True)
+
+    assert reports[0]['status'] == 'imported'
+    assert (models_path / 'iris' / '1' / 'iris.onnx').read_bytes() == b'new model'
+    assert not os.path.exists(old_object)
+
+
+def test_existing_versions_are_kept_without_overwrite(tmp_path, models_path):
+    write_sample(tmp_path / 'old', 'iris', 1, b'old model')
+    bulk_import.import_models(QueueClient(), str(tmp_path / 'old'))
+    redis_client = QueueClient()
+
+    reports = bulk_import.import_models(redis_client, str(tmp_path / 'old'))
+
+    assert reports[0]['status'] == 'exists'
+    assert 'models_to_add' not in redis_client.queues
+
+
+def test_missing_warmup_samples_are_invalid(tmp_path, models_path):
+    write_sample(tmp_path / 'samples', 'iris', 1, b'model')
+    json_path = tmp_path / 'samples' / 'iris' / 'iris.json'
+    model_data = json.loads(json_path.read_text())
+    model_data['model']['warmup'] = {"enabled": True, "sample": "utils/sample.npy"}
+    json_path.write_text(json.dumps(model_data))
+
+    reports = bulk_import.import_models(QueueClient(), str(tmp_path / 'samples'))
+
+    assert reports[0]['status'] == 'invalid'
+    assert "Warm-up sample 'utils/sample.npy' not found" in reports[0]['message']
+
+
+def test_archives_only_extract_files_and_folders(tmp_path):
+    fifo = tarfile.TarInfo('iris/1/pipe')
+    fifo.type = tarfile.FIFOTYPE
+    link = tarfile.TarInfo('iris/1/link')
+    link.type = tarfile.SYMTYPE
+    link.linkname = '/etc/passwd'
+    model_file = tarfile.TarInfo('iris/1/iris.onnx')
+    model_file.size = 5
+    with tarfile.open(tmp_path / 'models.tar', 'w') as archive:
+        archive.addfile(fifo)
+        archive.addfile(link)
+        archive.addfile(model_file, io.BytesIO(b'model'))
+
+    bulk_import.extract_archive(str(tmp_path / 'models.tar'), str(tmp_path / 'extracted'))
+
+    assert os.listdir(tmp_path / 'extracted' / 'iris' / '1') == ['iris.onnx']
+
+
+def test_files_that_are_not_tarballs_are_archive_errors(tmp_path):
+    (tmp_path / 'models.tar').write_bytes(b'not a tarball')
+
+    with pytest.raises(bulk_import.ArchiveError, match="not a valid tarball"):
+        bulk_import.import_models(QueueClient(), str(tmp_path / 'models.tar'))
+
+
+def test_members_outside_the_archive_are_archive_errors(tmp_path):
+    member = tarfile.TarInfo('../outside')
+    with tarfile.open(tmp_path / 'models.tar', 'w') as archive:
+        archive.addfile(member, io.BytesIO(b''))
+
+    with pytest.raises(bulk_import.ArchiveError, match="outside the archive"):
+        bulk_import.extract_archive(str(tmp_path / 'models.tar'), str(tmp_path / 'extracted'))
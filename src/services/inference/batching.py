@@ -0,0 +1,82 @@
+from concurrent.futures import Future
+
+import time
+import queue
+import threading
+import sparse_input
+
+
+class InputBatcher(threading.Thread):
+    '''
+    Runs the inputs of concurrent requests for a model as a single batch. A batch is run once it
+    holds 'max_batch_size' rows or once its first input waited 'max_wait' seconds. The thread stops
+    after 'idle_timeout' seconds without inputs, so batchers of deleted versions do not stay around.
+
+    Args:
+        run_batch (callable): runs the stacked inputs, one row per sample, and returns the model
+            outputs, each with one row per sample
+    '''
+
+    def __init__(self, run_batch, max_batch_size, max_wait, idle_timeout):
+        super().__init__(daemon=True)
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.idle_timeout = idle_timeout
+        self.inputs = queue.Queue()
+        self.lock = threading.Lock()
+        self.stopped = False
+
+    def submit(self, input_):
+        '''
+        Args:
+            input_ (numpy.ndarray or scipy.sparse matrix): one row per sample
+        Returns:
+            A Future holding the rows of every model output for this input,
+            or None once the batcher stopped
+        '''
+        future = Future()
+        with self.lock:
+            if self.stopped:
+                return None
+            self.inputs.put((input_, future))
+        return future
+
+    def run(self):
+        while True:
+            try:
+                batch = [self.inputs.get(timeout=self.idle_timeout)]
+            except queue.Empty:
+                with self.lock:
+                    if self.inputs.empty():
+                        self.stopped = True
+                        return
+                continue
+
+            # Futures must always be completed, or their requests would wait for good
+            try:
+                self.collect_inputs(batch)
+                self.run_inputs(batch)
+            except Exception as err:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(err)
+
+    def collect_inputs(self, batch):
+        rows = batch[0][0].shape[0]
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch_size:
+            try:
+                batch.append(self.inputs.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+            rows += batch[-1][0].shape[0]
+
+    def run_inputs(self, batch):
+        outputs = self.run_batch(sparse_input.stack_inputs([input_ for input_, _ in batch]))
+
+        start = 0
+        for input_, future in batch:
+            end = start + input_.shape[0]
+            future.set_result([output[start:end] for output in outputs])
+            start = end
@@ -0,0 +1,9 @@
+import os
+
+# With INFERENCE_PRELOAD=true the app (and every model formatter) is imported once by the
+# master and shared copy-on-write by the workers, instead of being imported by each worker.
+preload_app = os.environ.get('INFERENCE_PRELOAD', 'false').lower() == 'true'
+
+# Threaded workers keep their heartbeat while long stream sessions are open
+worker_class = 'gthread'
+threads = int(os.environ.get('INFERENCE_THREADS', '4'))
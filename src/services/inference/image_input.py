@@ -0,0 +1,106 @@
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+import numpy as np
+
+import os
+import cv2
+import threading
+import input_validation
+
+IMAGE_DECODE_THREADS = int(os.environ.get('IMAGE_DECODE_THREADS', '4'))
+
+# Requests with more images under the 'image' tag are rejected
+IMAGE_MAX_COUNT = int(os.environ.get('IMAGE_MAX_COUNT', '64'))
+
+# Larger batch buffers are allocated for their request only, instead of being kept by the thread
+IMAGE_BUFFER_MAX_BYTES = int(os.environ.get('IMAGE_BUFFER_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Created on first use, so each gunicorn worker gets its own threads after the fork
+executor = None
+
+# One uint8 buffer per target size, reused by every request handled by the same thread.
+# Each thread handles one request at a time, and tensorset copies the data to RedisAI.
+batch_buffers = threading.local()
+
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=IMAGE_DECODE_THREADS)
+    return executor
+
+
+def get_batch_buffer(size, images_count):
+    height, width = size
+    if images_count * height * width * 3 > IMAGE_BUFFER_MAX_BYTES:
+        return np.empty((images_count, height, width, 3), dtype=np.uint8)
+    if not hasattr(batch_buffers, 'sizes'):
+        batch_buffers.sizes = {}
+    batch_buffer = batch_buffers.sizes.get((height, width))
+    if batch_buffer is None or batch_buffer.shape[0] < images_count:
+        batch_buffer = np.empty((images_count, height, width, 3), dtype=np.uint8)
+        batch_buffers.sizes[(height, width)] = batch_buffer
+    return batch_buffer[:images_count]
+
+
+def decode_image(image_file, size=None, destination=None):
+    '''
+    Args:
+        image_file (file): the uploaded image
+        size (list): height and width the image is resized to, or None to keep its size
+            Ex: [224, 224]
+        destination (numpy.ndarray): uint8 array of shape (height, width, 3) receiving the image
+    Returns:
+        The RGB image as a numpy.ndarray
+    Raises:
+        InputError: the file is not an image PIL can decode
+    '''
+    try:
+        image = Image.open(image_file)
+        if size:
+            # For JPEG files, decodes straight to the smallest 1/2, 1/4 or 1/8 scale that is still
+            # larger than 'size', instead of decoding the full resolution photo
+            image.draft('RGB', (size[1], size[0]))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        # Both PIL decoding and cv2.resize release the GIL
+        image = np.asarray(image)
+    # PIL raises OSError (e.g. UnidentifiedImageError) for corrupt files, which must not look like a missing model
+    except (OSError, SyntaxError, Image.DecompressionBombError) as err:
+        raise input_validation.InputError("Image could not be decoded: " + str(err))
+    if not size:
+        return image
+    return cv2.resize(image, (size[1], size[0]), dst=destination)
+
+
+def read_images(image_files, size=None):
+    '''
+    Decodes and resizes the uploaded images, in parallel when there are many of them.
+
+    Args:
+        image_files (list): the uploaded images
+        size (list): height and width of the model input, or None to keep the image sizes
+            Ex: [224, 224]
+    Returns:
+        A list with one RGB image (numpy.ndarray) per uploaded image
+    Raises:
+        InputError: more than IMAGE_MAX_COUNT images were sent, or an image could not be decoded
+    '''
+    if len(image_files) > IMAGE_MAX_COUNT:
+        raise input_validation.InputError("Request has " + str(len(image_files)) + " images, at most " +
+                                          str(IMAGE_MAX_COUNT) + " are accepted")
+
+    if not size:
+        if len(image_files) == 1:
+            return [decode_image(image_files[0])]
+        return list(get_executor().map(decode_image, image_files))
+
+    batch_buffer = get_batch_buffer(size, len(image_files))
+    if len(image_files) == 1:
+        decode_image(image_files[0], size, batch_buffer[0])
+    else:
+        list(get_executor().map(lambda i: decode_image(image_files[i], size, batch_buffer[i]),
+                                range(len(image_files))))
+    return list(batch_buffer)
@@ -1,22 +1,63 @@
-from flask import Flask, jsonify, request
-from skimage import io
+from flask import Flask, Response, g, jsonify, make_response, request, stream_with_context
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from contextlib import contextmanager
 
+import numpy as np
+
+import tracing
+import routing
+import batching
+import sparse_input
+import input_validation
+import sharding
+import profiling
+import structured_logging
+
+import io
 import os
+import sys
+import gc
 import time
 import json
+import uuid
+import queue
+import hmac
+import base64
 import redis
-import redisai
+import threading
+import contextvars
 import logging
 import importlib
 
 
 app = Flask(__name__)
 
-redis_client = redisai.Client(host='redisai', port=6379)
+# Queues, jobs and profiles. Models and their tensors live on the nodes chosen by 'sharding'.
+redis_client = sharding.control_client
 
-logging.basicConfig(format='%(message)s', level=logging.INFO)
+structured_logging.setup_logging()
 logger = logging.getLogger(__name__)
 
+# Number of frames of a stream session running at the same time
+STREAM_PIPELINE_DEPTH = int(os.environ.get('STREAM_PIPELINE_DEPTH', '4'))
+
+# Threads running shadow requests, and shadow requests allowed to wait for them before new ones are dropped
+ROUTING_SHADOW_WORKERS = int(os.environ.get('ROUTING_SHADOW_WORKERS', '2'))
+ROUTING_SHADOW_QUEUE = int(os.environ.get('ROUTING_SHADOW_QUEUE', '64'))
+
+# Seconds a job (and its result) is kept in Redis
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', '3600'))
+
+# Longest long-poll allowed, kept below the nginx proxy timeout
+JOB_MAX_WAIT = int(os.environ.get('JOB_MAX_WAIT', '30'))
+
+# Seconds a request waits for the batch running its input, and seconds an idle batcher thread is kept
+BATCHING_RESULT_TIMEOUT = float(os.environ.get('BATCHING_RESULT_TIMEOUT', '60'))
+BATCHING_IDLE_TIMEOUT = float(os.environ.get('BATCHING_IDLE_TIMEOUT', '60'))
+
+# Admin endpoints require it in the 'X-Admin-Token' header, and are disabled while it is not set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN') or None
+
 model_extensions = {"tensorflow": "pb",
                     "tensorflow_lite": "pb",
                     "spark": "onnx",
@@ -25,8 +66,244 @@ model_extensions = {"tensorflow": "pb",
                     "onnx": "onnx"}
 
 
-def unregister_tensor(tensor):
-    redis_client.lpush('tensors_to_delete', tensor)
+# Every request is a span, continuing the trace of the caller when a 'traceparent' header is sent
+@app.before_request
+def start_request_span():
+    g.request_span = tracing.start_span(request.method + ' ' + str(request.url_rule),
+                                        tracing.parse_traceparent(request.headers.get('traceparent')))
+
+
+@app.after_request
+def add_traceparent(response):
+    request_span, _ = g.request_span
+    request_span.set('http.status_code', response.status_code)
+    response.headers['traceparent'] = request_span.traceparent
+    return response
+
+
+@app.teardown_request
+def end_request_span(error):
+    # Streamed responses tear the request down twice, so every hook pops what it ends
+    if 'request_span' in g:
+        tracing.end_span(*g.pop('request_span'), error)
+
+
+# Time spent by the current request in each stage, in milliseconds.
+# Shared with the threads running stream frames, since they run in a copy of the request context.
+stage_timings = contextvars.ContextVar('stage_timings', default=None)
+
+
+@contextmanager
+def stage(name, **attributes):
+    start = time.perf_counter()
+    try:
+        with tracing.span(name, **attributes):
+            yield
+    finally:
+        timings = stage_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0) + (time.perf_counter() - start) * 1000
+
+
+# One summary per request replaces a log line per stage
+@app.before_request
+def start_request_summary():
+    g.request_start = time.perf_counter()
+    stage_timings.set({})
+
+
+@app.after_request
+def keep_status_code(response):
+    g.status_code = response.status_code
+    return response
+
+
+@app.teardown_request
+def log_request_summary(error):
+    if 'request_start' not in g:
+        return
+    request_start = g.pop('request_start')
+    view_args = request.view_args or {}
+    logger.info("%s %s %s",
+                request.method,
+                request.path,
+                g.get('status_code', 500),
+                extra={"event": "request",
+                       "model": view_args.get('model_name', '') + '/' + view_args.get('model_version', g.get('model_version', '')),
+                       "status": g.get('status_code', 500),
+                       "duration_ms": round((time.perf_counter() - request_start) * 1000, 3),
+                       "stages": {name: round(duration, 3) for name, duration in (stage_timings.get() or {}).items()}})
+
+
+# Requests for a model with an open profiling session are profiled as a whole
+@app.before_request
+def start_request_profile():
+    if request.view_args and 'model_version' in request.view_args and not request.path.startswith('/inference/admin/'):
+        g.request_profile = profiling.start_profiling(redis_client,
+                                                      request.view_args['model_name'] + '/' + request.view_args['model_version'])
+
+
+@app.teardown_request
+def end_request_profile(error):
+    if g.get('request_profile'):
+        profiling.stop_profiling(redis_client, g.pop('request_profile'))
+
+
+# Descriptor and formatter of every model version already used by this process, so requests
+# do not open the JSON file and reload 'formatter.py' every time.
+# Entries are refreshed when one of both files changes on disk (e.g. after a model update).
+loaded_models = {}
+
+
+# Files are compared by inode too, since updated files may be hard links to older store objects
+def file_signature(path):
+    file_stat = os.stat(path)
+    return file_stat.st_ino, file_stat.st_mtime_ns
+
+
+def load_model(model_name, model_version):
+    '''
+    Args:
+        model_name (string): the name of the model
+            Ex: iris
+        model_version (string): the version of the model
+            Ex: 1
+    Returns:
+        A tuple with the 'model' object from <model_name>.json and the 'formatter' module.
+        The input validator of the model is kept with them (see 'prepare_input').
+    '''
+    model_name_redis = model_name + '/' + model_version
+
+    # Model path was mounted inside /inference because this script needs to import /utils for some models.
+    # For Python, is better to use modules that are already inside the current folder.
+    model_path = os.path.join('models',
+                              model_name,
+                              model_version)
+
+    json_path = os.path.join(model_path,
+                             model_name + ".json")
+
+    json_signature = file_signature(json_path)
+    loaded_model = loaded_models.get(model_name_redis)
+
+    if loaded_model and loaded_model['json_signature'] == json_signature:
+        if loaded_model['formatter_signature'] == file_signature(loaded_model['formatter_path']):
+            return loaded_model['model'], loaded_model['formatter']
+
+    with open(json_path) as json_file:
+        model = json.load(json_file)['model']
+
+    model_utils_python_path = os.path.join(model_path,
+                                           model['script']['folder']).replace(os.path.sep, '.')
+
+    formatter_path = os.path.join(model_path,
+                                  model['script']['folder'],
+                                  'formatter.py')
+
+    # Changed formatters are reloaded. New ones are only imported, so their module code runs once.
+    formatter_module = model_utils_python_path + '.formatter'
+    if formatter_module in sys.modules:
+        formatter = importlib.reload(sys.modules[formatter_module])
+    else:
+        formatter = importlib.import_module(formatter_module)
+
+    logger.info("Model '%s' loaded with formatter from '%s'",
+                model_name_redis,
+                model_utils_python_path,
+                extra={"event": "model_loaded", "model": model_name_redis})
+
+    # Image inputs are checked while decoding, other inputs once pre-processed.
+    # Descriptors without 'dtype' and 'shape' (TensorFlow models) have no validator.
+    validator = None
+    if model['backend']['parameters']['input']['type'] != 'image' and \
+            'dtype' in model['backend']['parameters']['input']:
+        validator = input_validation.TensorValidator(model['backend']['parameters']['input'])
+
+    loaded_models[model_name_redis] = {"model": model,
+                                       "formatter": formatter,
+                                       "validator": validator,
+                                       "formatter_path": formatter_path,
+                                       "json_signature": json_signature,
+                                       "formatter_signature": file_signature(formatter_path)}
+    return model, formatter
+
+
+def prepare_input(model_name_redis, input_):
+    '''
+    Checks the output of 'pre_process' against the declared input of the model.
+
+    Args:
+        input_ (list, numpy.ndarray or scipy.sparse matrix): the output of 'pre_process'
+    Returns:
+        A contiguous array, or a CSR matrix for sparse features, of the declared dtype
+    '''
+    validator = loaded_models[model_name_redis]['validator']
+    if validator is None:
+        return input_
+    if sparse_input.is_sparse(input_):
+        return validator.validate_sparse(input_)
+    return validator.validate(input_)
+
+
+# Models declaring a 'sparse' input receive three tensors, like the placeholders of a TensorFlow SparseTensor
+def get_input_keys(model, input_label):
+    if model['backend']['parameters']['input'].get('sparse'):
+        return [input_label + "_indices", input_label + "_values", input_label + "_dense_shape"]
+    return [input_label]
+
+
+def set_input_tensors(model_client, model, input_label, input_):
+    '''
+    Sets a prepared input as the input tensors of a model: as indices, values and dense shape for models
+    declaring a 'sparse' input, or as a single dense tensor otherwise. Sparse features are only made dense
+    here, in a buffer reused by the thread, so requests never allocate a vocabulary-sized array.
+    '''
+    if model['backend']['parameters']['input'].get('sparse'):
+        tensors = sparse_input.to_coo_tensors(input_)
+    elif sparse_input.is_sparse(input_):
+        tensors = [sparse_input.densify(input_)]
+    else:
+        tensors = [input_]
+
+    with stage('tensorset'):
+        for key, tensor in zip(get_input_keys(model, input_label), tensors):
+            model_client.tensorset(key, tensor)
+
+
+def unregister_input(model, input_label, model_client):
+    for key in get_input_keys(model, input_label):
+        unregister_tensor(key, model_client)
+
+
+def preload_models():
+    '''
+    Imports heavy dependencies and loads every model version found in 'models'.
+    Run by the gunicorn master when preloading, so workers share these pages copy-on-write.
+    '''
+    for model_entry in os.scandir('models'):
+        if not model_entry.is_dir() or model_entry.name.startswith('.'):
+            continue
+        for version_entry in os.scandir(model_entry.path):
+            if not version_entry.is_dir():
+                continue
+            try:
+                model, _ = load_model(model_entry.name, version_entry.name)
+                if model['backend']['parameters']['input']['type'] == 'image':
+                    import image_input
+            except Exception as err:
+                logger.error("Model '%s/%s' could not be preloaded",
+                             model_entry.name,
+                             version_entry.name,
+                             extra={"event": "preload_error", "error": str(err)})
+
+    # Objects created so far are never collected, so the garbage collector does not
+    # write to (and copy) the pages shared with the workers
+    gc.freeze()
+
+
+# Tensors are queued for removal on the node holding them
+def unregister_tensor(tensor, model_client):
+    model_client.lpush('tensors_to_delete', tracing.inject(tensor))
 
 
 def create_outputs(model_name, model_version, size):
@@ -37,70 +314,309 @@ def create_outputs(model_name, model_version, size):
     return model_outputs
 
 
-def get_outputs(model_outputs):
+def get_outputs(model_outputs, model_client):
     model_output_data = []
-    try:
-        for output in model_outputs:
-            model_output_data.append(redis_client.tensorget(output))
-    except redis.exceptions.ResponseError as err:
-        pass
+    with stage('tensorget'):
+        try:
+            for output in model_outputs:
+                model_output_data.append(model_client.tensorget(output))
+        except redis.exceptions.ResponseError as err:
+            pass
     return model_output_data
 
 
-@ app.route('/inference/<model_name>/<model_version>/')
-def run_inference(model_name, model_version):
+def count_outputs(model):
+    if model['backend']['parameters']['input']['type'] == 'image':
+        return len(model['backend']['parameters']['output']['labels'])
+    # For now we are assuming that our input shape is always [1, x], so we only need to get the second value.
+    return model['backend']['parameters']['output']['shape'][1]
+
+
+def run_batch(model_name_redis, input_):
+    '''
+    Runs the stacked inputs of concurrent requests in a single 'modelrun', from the batcher thread of the model.
+
+    Args:
+        input_ (numpy.ndarray or scipy.sparse.csr_matrix): one row per sample
+    Returns:
+        The model outputs, each with one row per sample
+    '''
+    model = loaded_models[model_name_redis]['model']
+    model_client = sharding.model_client(model_name_redis, sharding.get_replicas(model))
+    batch_label = model_name_redis.replace('/', '_') + "_batch_" + uuid.uuid4().hex
+    input_label = batch_label + "_input"
+    output_labels = [batch_label + "_output_" + str(i) for i in range(count_outputs(model))]
     try:
-        model_name_redis = model_name + '/' + model_version
+        with tracing.span('batch', model=model_name_redis, size=input_.shape[0]):
+            set_input_tensors(model_client, model, input_label, input_)
+            with stage('modelrun', model=model_name_redis):
+                model_client.modelrun(model_name_redis, get_input_keys(model, input_label), output_labels)
+            return get_outputs(output_labels, model_client)
+    finally:
+        unregister_input(model, input_label, model_client)
+        for label in output_labels:
+            unregister_tensor(label, model_client)
 
-        # Model path was mounted inside /inference because this script needs to import /utils for some models.
-        # For Python, is better to use modules that are already inside the current folder.
-        model_path = os.path.join('models',
-                                  model_name,
-                                  model_version)
 
-        json_path = os.path.join(model_path,
-                                 model_name + ".json")
+# Batcher thread of each model version declaring 'batching' in its <model_name>.json, for this worker.
+# Idle batchers stop (and are replaced on the next request), so deleted versions do not keep a thread.
+batchers = {}
+batchers_lock = threading.Lock()
 
-        with open(json_path) as json_file:
-            model_data = json.load(json_file)
-            model = model_data['model']
 
-        logger.info("JSON file for model '" + model_name_redis + "'opened.")
+def get_batcher(model_name_redis, model):
+    with batchers_lock:
+        batcher = batchers.get(model_name_redis)
+        # Batchers of a previous descriptor finish their queued inputs, then stop once idle
+        if batcher is None or batcher.stopped or batcher.settings != model['batching']:
+            batcher = batching.InputBatcher(lambda input_: run_batch(model_name_redis, input_),
+                                            model['batching'].get('max_batch_size', 32),
+                                            model['batching'].get('max_wait_ms', 2) / 1000,
+                                            BATCHING_IDLE_TIMEOUT)
+            batcher.settings = model['batching']
+            batcher.start()
+            batchers[model_name_redis] = batcher
+        return batcher
 
-        model_utils_python_path = os.path.join(model_path,
-                                               model['script']['folder']).replace(os.path.sep, '.')
 
-        logger.info("Importing module 'formatter.py' from '" +
-                    model_utils_python_path + "' for model '" + model_name_redis + "'")
+def run_batched(model_name_redis, model, input_):
+    '''
+    Runs an input in the next batch of the model, with the inputs of other requests of this worker.
 
-        formatter = importlib.reload(importlib.import_module('.formatter',
-                                                             model_utils_python_path))
+    Returns:
+        The rows of every model output for this input
+    Raises:
+        InputError: the input has no batch dimension to stack it by
+        concurrent.futures.TimeoutError: the batch did not run within BATCHING_RESULT_TIMEOUT
+    '''
+    # Descriptors without dtype and shape have no validator, so their inputs are made arrays here
+    if not sparse_input.is_sparse(input_):
+        input_ = np.asarray(input_)
+        if input_.ndim < 2 or input_.dtype.kind not in 'biuf':
+            raise input_validation.InputError("Batched inputs must be numbers with a batch dimension, got " +
+                                              input_.dtype.name + " of shape " + str(list(input_.shape)))
 
-        logger.info("Module 'formatter.py' for model '" +
-                    model_name_redis + "' imported.")
+    future = None
+    while future is None:
+        future = get_batcher(model_name_redis, model).submit(input_)
+    return future.result(timeout=BATCHING_RESULT_TIMEOUT)
 
-        input_request = ''
+
+def run_frame(model_name_redis, model, formatter, frame, input_label, output_labels, model_client):
+    '''
+    Runs one input of a stream session, reusing the tensor keys of its pipeline slot.
+
+    Args:
+        frame (dict): one line of the stream, holding 'input' or a base64 encoded 'image'
+            (the raw bytes for shadow requests)
+        model_client (redisai.Client): client of the node running the model
+    Returns:
+        The dict returned by 'post_process'
+    '''
+    if model['backend']['parameters']['input']['type'] == 'image':
+        import image_input
+
+        # Stream lines send base64 strings, shadow requests the raw bytes of the mirrored image
+        image = frame['image']
+        if isinstance(image, str):
+            image = base64.b64decode(image)
+        with stage('decode_images'):
+            input_parameter = image_input.decode_image(io.BytesIO(image),
+                                                       model['backend']['parameters']['input'].get('size'))
+        with stage('pre_process'):
+            input_ = formatter.pre_process(input_parameter)
+        with stage('tensorset'):
+            model_client.tensorset(input_label, input_)
+    else:
+        with stage('pre_process'):
+            input_ = formatter.pre_process(frame['input'])
+        with stage('validate'):
+            input_ = prepare_input(model_name_redis, input_)
+        set_input_tensors(model_client, model, input_label, input_)
+
+    with stage('modelrun', model=model_name_redis):
+        model_client.modelrun(model_name_redis, get_input_keys(model, input_label), output_labels)
+    model_output_data = get_outputs(output_labels, model_client)
+    with stage('post_process'):
+        output_ = formatter.post_process(model_output_data)
+
+    if not isinstance(output_, dict):
+        raise TypeError("'post_process' module did not return a valid dict")
+    return output_
+
+
+def get_frame_result(sequence, future):
+    try:
+        return {"sequence": sequence, "output": future.result()}
+    except Exception as err:
+        return {"sequence": sequence, "error": type(err).__name__, "message": str(err)}
+
+
+stream_executor = None
+
+
+def read_frames(lines, start_frame, pending):
+    '''
+    Reads the lines of a stream session in its own thread, so results are sent back
+    while the client is still writing the next frames.
+
+    Args:
+        lines (iterable): the NDJSON lines sent by the client
+        start_frame (callable): starts a frame from its sequence and parsed line,
+            returning False once the session is closed
+        pending (queue.Queue): receives the (slot, sequence, future) of every frame, then None
+    '''
+    try:
+        for sequence, line in enumerate(lines):
+            if not line.strip():
+                continue
+
+            try:
+                frame = json.loads(line)
+            except ValueError:
+                # Kept in the pipeline, so results are still returned in order
+                future = Future()
+                future.set_exception(ValueError("Line is not valid JSON"))
+                pending.put((None, sequence, future))
+                continue
+
+            if not start_frame(sequence, frame):
+                return
+    except Exception as err:
+        logger.warning("Stream session input could not be read", extra={"event": "stream_read_error", "error": str(err)})
+    finally:
+        pending.put(None)
+
+
+def stream_inference(model_name, model_version, model, formatter, lines):
+    '''
+    Runs every line of a stream through the model, with up to STREAM_PIPELINE_DEPTH frames in flight.
+    Each pipeline slot owns its tensor keys for the whole session, so frames overwrite them
+    instead of creating (and later deleting) new keys.
+
+    Args:
+        lines (iterable): the NDJSON lines sent by the client
+    Yields:
+        One NDJSON line per frame, as soon as it finished, in the order the frames were sent
+    '''
+    global stream_executor
+    if stream_executor is None:
+        stream_executor = ThreadPoolExecutor(max_workers=STREAM_PIPELINE_DEPTH)
+
+    model_name_redis = model_name + '/' + model_version
+    # Every frame of a session runs on the same node, which holds the tensors of its slots
+    model_client = sharding.model_client(model_name_redis, sharding.get_replicas(model))
+    session_label = model_name + "_" + model_version + "_stream_" + str(time.time())
+    slots = [(session_label + "_input_" + str(slot),
+              [session_label + "_output_" + str(slot) + "_" + str(i) for i in range(count_outputs(model))])
+             for slot in range(STREAM_PIPELINE_DEPTH)]
+
+    free_slots = queue.Queue()
+    for slot in range(STREAM_PIPELINE_DEPTH):
+        free_slots.put(slot)
+    pending = queue.Queue()
+    session_lock = threading.Lock()
+    closed = threading.Event()
+
+    def start_frame(sequence, frame):
+        # Waits for a free slot, so the client is not read further than the pipeline depth
+        slot = free_slots.get()
+        with session_lock:
+            if slot is None or closed.is_set():
+                return False
+            input_label, output_labels = slots[slot]
+            # Copies the context of the reader, so frame spans belong to the session trace
+            pending.put((slot,
+                         sequence,
+                         stream_executor.submit(contextvars.copy_context().run,
+                                                run_frame,
+                                                model_name_redis,
+                                                model,
+                                                formatter,
+                                                frame,
+                                                input_label,
+                                                output_labels,
+                                                model_client)))
+        return True
+
+    threading.Thread(target=contextvars.copy_context().run,
+                     args=(read_frames, lines, start_frame, pending),
+                     daemon=True).start()
+    try:
+        while True:
+            started_frame = pending.get()
+            if started_frame is None:
+                break
+            slot, frame_sequence, frame_future = started_frame
+            # Waits on the oldest frame only, so results keep the order of the frames
+            yield json.dumps(get_frame_result(frame_sequence, frame_future)) + "\n"
+            if slot is not None:
+                free_slots.put(slot)
+    finally:
+        with session_lock:
+            closed.set()
+        # Wakes up the reader if it waits for a slot
+        free_slots.put(None)
+
+        # Client went away: frames already running must finish before their keys are released
+        futures = []
+        while not pending.empty():
+            started_frame = pending.get()
+            if started_frame is not None:
+                started_frame[2].cancel()
+                futures.append(started_frame[2])
+        wait(futures)
+        for input_label, output_labels in slots:
+            unregister_input(model, input_label, model_client)
+            for label in output_labels:
+                unregister_tensor(label, model_client)
+        logger.info("Stream session for model '%s' closed", model_name_redis,
+                    extra={"event": "stream_closed", "model": model_name_redis})
+
+
+@ app.route('/inference/<model_name>/<model_version>/')
+def run_inference(model_name, model_version):
+    try:
+        model_name_redis = model_name + '/' + model_version
+        model_client = None
+        model_output_data = None
         model_output_labels = []
         model_input_label = model_name + "_" + \
             model_version + "_input_" + str(time.time())
 
-        logger.info("Parsing request...")
+        with stage('load_model'):
+            model, formatter = load_model(model_name, model_version)
+
+        model_client = sharding.model_client(model_name_redis, sharding.get_replicas(model))
+
+        input_request = ''
+        images_count = 1
 
         if model['backend']['parameters']['input']['type'] == 'image':
             if model['backend']['type']:
                 if request.files:
                     if 'image' in request.files:
-                        logger.info("Getting input image from request...")
-                        image = request.files['image']
+                        # PIL and cv2 are only needed by image models, so they are not imported before the first image request
+                        import image_input
+
+                        images = request.files.getlist('image')
+                        images_count = len(images)
 
-                        input_parameter = io.imread(image)
-                        logger.info("Image opened.")
+                        with stage('decode_images', images=images_count):
+                            input_parameters = image_input.read_images(images,
+                                                                       model['backend']['parameters']['input'].get('size'))
 
-                        input_ = formatter.pre_process(input_parameter)
-                        logger.info("Image pre-processed.")
+                        # Many images under the 'image' tag are sent to the model as a single batch
+                        with stage('pre_process'):
+                            inputs = [formatter.pre_process(input_parameter)
+                                      for input_parameter in input_parameters]
+                            if images_count == 1:
+                                input_ = inputs[0]
+                            else:
+                                input_ = np.concatenate(inputs)
 
-                        redis_client.tensorset(model_input_label, input_)
-                        logger.info("Tensor set.")
+                        with stage('tensorset'):
+                            model_client.tensorset(model_input_label, input_)
 
                         model_output_labels = create_outputs(model_name,
                                                              model_version,
@@ -116,72 +632,435 @@ def run_inference(model_name, model_version):
                 return jsonify(error="Bad Request",
                                message="Sorry, but only tensorflow models support images as input"), 400
         else:
-            inference_request = request.get_json(force=True)
+            inference_request = request.get_json(force=True, silent=True)
+            if not isinstance(inference_request, dict) or 'input' not in inference_request:
+                return jsonify(error="Bad Request", message="Request must be a JSON object with an 'input'"), 400
             input_parameter = inference_request['input']
 
-            input_ = formatter.pre_process(input_parameter)
+            with stage('pre_process'):
+                input_ = formatter.pre_process(input_parameter)
 
-            redis_client.tensorset(model_input_label,
-                                   input_,
-                                   dtype=model['backend']['parameters']['input']['dtype'],
-                                   shape=tuple(model['backend']['parameters']['input']['shape']))
+            # Bad inputs are rejected here, before any round trip to RedisAI
+            with stage('validate'):
+                input_ = prepare_input(model_name_redis, input_)
 
-            # For now we are assuming that our input shape is always [1, x], so we only need to get the second value.
-            model_output_labels = create_outputs(model_name,
-                                                 model_version,
-                                                 model['backend']['parameters']['output']['shape'][1])
+            if 'batching' in model:
+                # Tensors of the batch are set and removed by the batcher thread
+                model_client = None
+                with stage('batch'):
+                    model_output_data = run_batched(model_name_redis, model, input_)
+            else:
+                set_input_tensors(model_client, model, model_input_label, input_)
 
-        redis_client.modelrun(model_name_redis,
-                              [model_input_label],
-                              model_output_labels)
+                # For now we are assuming that our input shape is always [1, x], so we only need to get the second value.
+                model_output_labels = create_outputs(model_name,
+                                                     model_version,
+                                                     model['backend']['parameters']['output']['shape'][1])
 
-        model_output_data = get_outputs(model_output_labels)
+        if model_output_data is None:
+            with stage('modelrun', model=model_name_redis):
+                model_client.modelrun(model_name_redis,
+                                      get_input_keys(model, model_input_label),
+                                      model_output_labels)
 
-        logger.info("Post-processing...")
-        output_ = formatter.post_process(model_output_data)
+            model_output_data = get_outputs(model_output_labels, model_client)
 
-        if not isinstance(output_, dict):
-            logger.error("Model '" + model_name_redis +
-                         "' not found in RedisAI")
+        # 'post_process' handles one input at a time, so batched outputs are split per image
+        with stage('post_process'):
+            outputs = [formatter.post_process([output[i:i + 1] for output in model_output_data])
+                       if images_count > 1 else formatter.post_process(model_output_data)
+                       for i in range(images_count)]
+
+        if not all(isinstance(output_, dict) for output_ in outputs):
+            logger.error("'post_process' module for model '%s' did not return a valid dict", model_name_redis,
+                         extra={"event": "inference_error", "model": model_name_redis})
             return jsonify(error="Bad Request", message="'post_process' module did not return a valid dict"), 400
 
-        return jsonify(output=output_)
+        if images_count > 1:
+            return jsonify(outputs=outputs)
+
+        return jsonify(output=outputs[0])
+
+    except input_validation.InputError as err:
+        logger.info("Invalid input for model '%s'", model_name_redis,
+                    extra={"event": "invalid_input", "model": model_name_redis, "error": str(err)})
+        return jsonify(error="Bad Request", message=str(err)), 400
+
+    except input_validation.DescriptorError as err:
+        logger.error("Descriptor of model '%s' is invalid", model_name_redis,
+                     extra={"event": "inference_error", "model": model_name_redis, "error": str(err)})
+        return jsonify(error="Internal Server Error",
+                       message="Descriptor of model '" + model_name_redis + "' is invalid", details=str(err)), 500
+
+    except FutureTimeoutError as err:
+        logger.error("Batch for model '%s' did not run in time", model_name_redis,
+                     extra={"event": "inference_error", "model": model_name_redis, "error": "batch timeout"})
+        return jsonify(error="Gateway Timeout",
+                       message="Batch for model '" + model_name_redis + "' did not run in time"), 504
 
     except IndexError as err:
-        logger.error("Index selected probably inside 'post_process' module for model '" +
-                     model_name_redis + "' is invalid.")
-        logger.error(str(err))
+        logger.error("Index selected probably inside 'post_process' module for model '%s' is invalid", model_name_redis,
+                     extra={"event": "inference_error", "model": model_name_redis, "error": str(err)})
         return jsonify(error="Conflict", message="Index selected probably inside 'post_process' module for model '" +
                        model_name_redis + "' is invalid.", details=str(err)), 409
 
     except TypeError as err:
-        logger.error("Tensor type for model '" +
-                     model_name_redis + "' is invalid.")
-        logger.error(str(err))
+        logger.error("Tensor type for model '%s' is invalid", model_name_redis,
+                     extra={"event": "inference_error", "model": model_name_redis, "error": str(err)})
         return jsonify(error="Bad Request", message="Tensor type for model '" + model_name_redis + "' is invalid", details=str(err)), 404
 
     except redis.exceptions.ResponseError as err:
         err_message = str(err)
         if err_message == "model key is empty":
-            logger.error("Model '" + model_name_redis +
-                         "' not registered in RedisAI")
-            logger.error(str(err))
+            logger.error("Model '%s' not registered in RedisAI", model_name_redis,
+                         extra={"event": "inference_error", "model": model_name_redis, "error": str(err)})
             return jsonify(error="Not Found", message="Model '" + model_name_redis + "' is not loaded"), 404
-        logger.error("Error inferencing model '" + model_name_redis + "'")
-        logger.error(str(err))
+        logger.error("Error inferencing model '%s'", model_name_redis,
+                     extra={"event": "inference_error", "model": model_name_redis, "error": str(err)})
         return jsonify(error="Internal Server Error", message="Error inferencing model '" + model_name_redis + "'", details=str(err)), 500
 
     except OSError as err:
-        logger.error("Model '" + model_name_redis + "' not found")
-        logger.error(str(err))
+        logger.error("Model '%s' not found", model_name_redis,
+                     extra={"event": "inference_error", "model": model_name_redis, "error": str(err)})
         return jsonify(error="Not Found", message="Model not loaded"), 404
 
     except Exception as err:
-        logger.error("Error during inference for model '" +
-                     model_name_redis + "'")
-        logger.error(str(err))
+        logger.error("Error during inference for model '%s'", model_name_redis,
+                     extra={"event": "inference_error", "model": model_name_redis, "error": str(err)})
         return jsonify(error="Internal Server Error", message="Inference failed for model '" + model_name_redis + "'", details=str(err)), 404
     finally:
-        unregister_tensor(model_input_label)
-        for label in model_output_labels:
-            unregister_tensor(label)
+        if model_client is not None:
+            unregister_input(model, model_input_label, model_client)
+            for label in model_output_labels:
+                unregister_tensor(label, model_client)
+
+
+shadow_executor = None
+shadow_slots = threading.BoundedSemaphore(ROUTING_SHADOW_QUEUE)
+
+
+def get_shadow_frame(model):
+    '''
+    Returns:
+        The input of the current request as a stream frame ({"input": ...} or {"image": <raw bytes>}),
+        or None for requests that can not be mirrored (e.g. many images)
+    '''
+    if model['backend']['parameters']['input']['type'] == 'image':
+        images = request.files.getlist('image')
+        if len(images) != 1:
+            return None
+        # Only copied here: the shadow task decodes the raw bytes, without a base64 round trip
+        frame = {"image": images[0].read()}
+        images[0].seek(0)
+        return frame
+
+    inference_request = request.get_json(force=True, silent=True)
+    if not isinstance(inference_request, dict) or 'input' not in inference_request:
+        return None
+    return {"input": inference_request['input']}
+
+
+def run_shadow(model_name, model_version, frame, primary_output):
+    model_name_redis = model_name + '/' + model_version
+    # Stages of shadow requests are not part of the summary of the request they mirror
+    stage_timings.set(None)
+    shadow_label = model_name + "_" + model_version + "_shadow_" + uuid.uuid4().hex
+    input_label = shadow_label + "_input"
+    output_labels = []
+    model_client = None
+    start = time.perf_counter()
+    try:
+        with tracing.span('shadow', model=model_name_redis):
+            model, formatter = load_model(model_name, model_version)
+            model_client = sharding.model_client(model_name_redis, sharding.get_replicas(model))
+            output_labels = [shadow_label + "_output_" + str(i) for i in range(count_outputs(model))]
+            output_ = run_frame(model_name_redis, model, formatter, frame, input_label, output_labels, model_client)
+        routing.record_latency(redis_client,
+                               model_name,
+                               'shadow',
+                               (time.perf_counter() - start) * 1000,
+                               agreed=routing.outputs_agree(primary_output, output_))
+    except Exception as err:
+        routing.record_latency(redis_client, model_name, 'shadow', (time.perf_counter() - start) * 1000, failed=True)
+        logger.error("Shadow request for model '%s' failed", model_name_redis,
+                     extra={"event": "shadow_error", "model": model_name_redis, "error": str(err)})
+    finally:
+        if model_client is not None:
+            unregister_input(model, input_label, model_client)
+            for label in output_labels:
+                unregister_tensor(label, model_client)
+        shadow_slots.release()
+
+
+def mirror_request(model_name, model_version, frame, primary_output):
+    '''
+    Runs a request again on the shadow version, after the caller got its response.
+    Requests are dropped when ROUTING_SHADOW_QUEUE shadow requests are already waiting.
+    '''
+    global shadow_executor
+    if not shadow_slots.acquire(blocking=False):
+        return
+    if shadow_executor is None:
+        shadow_executor = ThreadPoolExecutor(max_workers=ROUTING_SHADOW_WORKERS)
+    shadow_executor.submit(contextvars.copy_context().run,
+                           run_shadow,
+                           model_name,
+                           model_version,
+                           frame,
+                           primary_output)
+
+
+# Serves the version chosen by the routing rule of the model, set through /inference/admin/routing/<model_name>.
+# The chosen version is returned in the 'X-Model-Version' header.
+@ app.route('/inference/<model_name>/')
+def run_routed_inference(model_name):
+    rule = routing.get_rule(redis_client, model_name)
+    if not rule:
+        return jsonify(error="Not Found", message="No routing rule for model '" + model_name + "'"), 404
+
+    model_version, role = routing.choose_version(rule)
+    g.model_version = model_version
+    # The version is only known now, so 'start_request_profile' can not profile routed requests
+    g.request_profile = profiling.start_profiling(redis_client, model_name + '/' + model_version)
+
+    # Only requests served by the primary version are mirrored, so outputs are compared with it
+    shadow_frame = None
+    if role == 'primary' and routing.should_mirror(rule):
+        try:
+            shadow_frame = get_shadow_frame(load_model(model_name, model_version)[0])
+        except OSError:
+            pass
+
+    start = time.perf_counter()
+    response = make_response(run_inference(model_name, model_version))
+    routing.record_latency(redis_client,
+                           model_name,
+                           role,
+                           (time.perf_counter() - start) * 1000,
+                           failed=response.status_code != 200)
+
+    if shadow_frame is not None and response.status_code == 200 and 'output' in response.get_json():
+        mirror_request(model_name, rule['shadow']['version'], shadow_frame, response.get_json()['output'])
+
+    response.headers['X-Model-Version'] = model_version
+    return response
+
+
+# Jobs are hashes 'inference_job:<job_id>', consumed from the 'inference_jobs' queue by job_worker.py
+def job_key(job_id):
+    return 'inference_job:' + job_id
+
+
+# Receives an element once the job finished, so long-poll requests can block on it
+def job_done_key(job_id):
+    return 'inference_job_done:' + job_id
+
+
+def submit_jobs(model_name, model_version, frames):
+    job_ids = []
+    jobs = []
+    pipeline = redis_client.pipeline(transaction=False)
+    for frame in frames:
+        job_id = uuid.uuid4().hex
+        job_ids.append(job_id)
+        jobs.append(json.dumps({"id": job_id,
+                                "model": model_name,
+                                "version": model_version,
+                                "frame": frame,
+                                "traceparent": tracing.current_span.get().traceparent}))
+        pipeline.hset(job_key(job_id),
+                      mapping={"status": "queued",
+                               "model": model_name,
+                               "version": model_version,
+                               "submitted_at": str(time.time())})
+        pipeline.expire(job_key(job_id), JOB_RESULT_TTL)
+
+    # Workers take jobs from the tail with 'brpoplpush', so jobs are pushed to the head to run in order
+    pipeline.lpush('inference_jobs', *jobs)
+    pipeline.execute()
+    return job_ids
+
+
+def get_job(job_id):
+    job = {key.decode('utf-8'): value.decode('utf-8')
+           for key, value in redis_client.hgetall(job_key(job_id)).items()}
+    if 'output' in job:
+        job['output'] = json.loads(job['output'])
+    return job
+
+
+# Queues one job per input: {"input": ...} or {"inputs": [...]} as JSON,
+# or one or many files under the 'image' tag for image models
+@ app.route('/inference/<model_name>/<model_version>/jobs', methods=['POST'])
+def create_inference_jobs(model_name, model_version):
+    model_name_redis = model_name + '/' + model_version
+    try:
+        model, _ = load_model(model_name, model_version)
+    except OSError as err:
+        logger.error("Model '%s' not found", model_name_redis,
+                     extra={"event": "inference_error", "model": model_name_redis, "error": str(err)})
+        return jsonify(error="Not Found", message="Model not loaded"), 404
+
+    if model['backend']['parameters']['input']['type'] == 'image':
+        if 'image' not in request.files:
+            return jsonify(error="Bad Request",
+                           message="Images for inference must be placed under a tag named 'image' of a 'multipart/form-data' request"), 400
+        frames = [{"image": base64.b64encode(image.read()).decode('ascii')}
+                  for image in request.files.getlist('image')]
+    else:
+        inference_request = request.get_json(force=True)
+        if 'inputs' in inference_request:
+            frames = [{"input": input_parameter}
+                      for input_parameter in inference_request['inputs']]
+        elif 'input' in inference_request:
+            frames = [{"input": inference_request['input']}]
+        else:
+            return jsonify(error="Bad Request",
+                           message="Request must have an 'input' or an 'inputs' list"), 400
+
+    job_ids = submit_jobs(model_name, model_version, frames)
+    logger.info("%d jobs queued for model '%s'", len(job_ids), model_name_redis,
+                extra={"event": "jobs_queued", "model": model_name_redis, "jobs": len(job_ids)})
+
+    return jsonify(jobs=job_ids), 202
+
+
+# Returns the job status and, once done, its output.
+# With '?wait=<seconds>' the request blocks until the job finishes or the wait expires.
+@ app.route('/inference/jobs/<job_id>', methods=['GET'])
+def get_inference_job(job_id):
+    try:
+        wait = min(int(request.args.get('wait', 0)), JOB_MAX_WAIT)
+    except ValueError:
+        return jsonify(error="Bad Request", message="'wait' must be an integer number of seconds"), 400
+
+    job = get_job(job_id)
+    if not job:
+        return jsonify(error="Not Found", message="Job '" + job_id + "' not found or expired"), 404
+
+    if wait > 0 and job['status'] in ['queued', 'running']:
+        # Pops and pushes back the same element, so every waiting request is woken up
+        redis_client.brpoplpush(job_done_key(job_id), job_done_key(job_id), timeout=wait)
+        job = get_job(job_id)
+
+    return jsonify(id=job_id, **job)
+
+
+# Opens a stream session: the request body is a chunked NDJSON stream, one input per line
+# ({"input": ...} or {"image": "<base64>"}), and results are streamed back as NDJSON lines
+@ app.route('/inference/<model_name>/<model_version>/stream', methods=['POST'])
+def run_inference_stream(model_name, model_version):
+    model_name_redis = model_name + '/' + model_version
+    try:
+        model, formatter = load_model(model_name, model_version)
+    except OSError as err:
+        logger.error("Model '%s' not found", model_name_redis,
+                     extra={"event": "inference_error", "model": model_name_redis, "error": str(err)})
+        return jsonify(error="Not Found", message="Model not loaded"), 404
+
+    logger.info("Stream session for model '%s' opened", model_name_redis,
+                extra={"event": "stream_opened", "model": model_name_redis})
+    return Response(stream_with_context(stream_inference(model_name,
+                                                         model_version,
+                                                         model,
+                                                         formatter,
+                                                         request.stream)),
+                    mimetype='application/x-ndjson')
+
+
+def is_admin_request():
+    if ADMIN_TOKEN is None:
+        return False
+    # Compared in constant time, so the token can not be guessed from response times
+    return hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode('utf-8'),
+                               ADMIN_TOKEN.encode('utf-8'))
+
+
+# Profiles the next requests of a model on every worker:
+# {"mode": "sampling" | "deterministic", "requests": <count>, "seconds": <duration>}
+@ app.route('/inference/admin/profile/<model_name>/<model_version>', methods=['POST'])
+def create_profile_session(model_name, model_version):
+    if not is_admin_request():
+        return jsonify(error="Forbidden", message="Invalid admin token"), 403
+
+    profile_request = request.get_json(force=True, silent=True) or {}
+    mode = profile_request.get('mode', 'sampling')
+    requests_count = profile_request.get('requests', 100)
+    seconds = profile_request.get('seconds', 60)
+
+    if mode not in profiling.PROFILE_MODES:
+        return jsonify(error="Bad Request",
+                       message="'mode' must be one of " + ", ".join(profiling.PROFILE_MODES)), 400
+    if not isinstance(requests_count, int) or not isinstance(seconds, int) or requests_count < 1 or seconds < 1:
+        return jsonify(error="Bad Request",
+                       message="'requests' and 'seconds' must be positive integers"), 400
+
+    profiling.create_session(redis_client,
+                             model_name + '/' + model_version,
+                             mode,
+                             requests_count,
+                             seconds)
+
+    return jsonify(message="Profiling the next " + str(requests_count) + " requests for model '" +
+                   model_name + '/' + model_version + "' during at most " + str(seconds) + " seconds"), 201
+
+
+@ app.route('/inference/admin/profile/<model_name>/<model_version>', methods=['GET'])
+def get_profile(model_name, model_version):
+    if not is_admin_request():
+        return jsonify(error="Forbidden", message="Invalid admin token"), 403
+
+    return jsonify(profiling.get_profile(redis_client, model_name + '/' + model_version))
+
+
+@ app.route('/inference/admin/profile/<model_name>/<model_version>', methods=['DELETE'])
+def delete_profile_session(model_name, model_version):
+    if not is_admin_request():
+        return jsonify(error="Forbidden", message="Invalid admin token"), 403
+
+    profiling.delete_session(redis_client, model_name + '/' + model_version)
+    return jsonify(message="Profiling for model '" + model_name + '/' + model_version + "' stopped"), 200
+
+
+# Routes the requests sent to /inference/<model_name>/:
+# {"version": "1", "canary": {"version": "2", "weight": 0.1}, "shadow": {"version": "3", "sample_rate": 0.5}}
+# 'canary' and 'shadow' are optional. Statistics of the previous rule are discarded.
+@ app.route('/inference/admin/routing/<model_name>', methods=['POST'])
+def set_routing_rule(model_name):
+    if not is_admin_request():
+        return jsonify(error="Forbidden", message="Invalid admin token"), 403
+
+    rule = request.get_json(force=True, silent=True)
+    error_message = routing.validate_rule(rule)
+    if error_message:
+        return jsonify(error="Bad Request", message=error_message), 400
+
+    for version in [rule['version']] + [rule[role]['version'] for role in ['canary', 'shadow'] if role in rule]:
+        if not os.path.isfile(os.path.join('models', model_name, version, model_name + ".json")):
+            return jsonify(error="Not Found",
+                           message="Model '" + model_name + "/" + version + "' not found"), 404
+
+    routing.set_rule(redis_client, model_name, rule)
+    return jsonify(message="Routing rule for model '" + model_name + "' set"), 201
+
+
+# Latency percentiles of the versions of a model side by side, with the output agreement of the shadow version
+@ app.route('/inference/admin/routing/<model_name>', methods=['GET'])
+def get_routing_stats(model_name):
+    if not is_admin_request():
+        return jsonify(error="Forbidden", message="Invalid admin token"), 403
+
+    return jsonify(routing.get_stats(redis_client, model_name))
+
+
+@ app.route('/inference/admin/routing/<model_name>', methods=['DELETE'])
+def delete_routing_rule(model_name):
+    if not is_admin_request():
+        return jsonify(error="Forbidden", message="Invalid admin token"), 403
+
+    routing.delete_rule(redis_client, model_name)
+    return jsonify(message="Routing rule for model '" + model_name + "' deleted"), 200
+
+
+if os.environ.get('INFERENCE_PRELOAD', 'false').lower() == 'true':
+    preload_models()
@@ -0,0 +1,103 @@
+import numpy as np
+
+import tensor_types
+
+# Kinds of numpy arrays each kind of declared dtype accepts without losing information
+# ('b' bool, 'i' signed and 'u' unsigned integers, 'f' floats)
+ACCEPTED_KINDS = {"f": "biuf",
+                  "i": "biu",
+                  "u": "bu"}
+
+
+class InputError(ValueError):
+    pass
+
+
+# Raised for descriptors the inference service can not serve, as opposed to bad requests
+class DescriptorError(ValueError):
+    pass
+
+
+class TensorValidator:
+    '''
+    Checks and converts the inputs of a model against the 'input' of its <model_name>.json.
+    The first dimension of the declared shape is the batch size and may take any value.
+
+    Args:
+        input_spec (dict): the 'input' object from <model_name>.json
+            Ex: {"type": "number", "dtype": "float32", "shape": [1, 4]}
+    Raises:
+        DescriptorError: the declared dtype is not supported
+    '''
+
+    def __init__(self, input_spec):
+        try:
+            self.dtype = tensor_types.to_numpy_dtype(input_spec['dtype'])
+        except ValueError as err:
+            raise DescriptorError(str(err))
+        self.shape = tuple(input_spec['shape'])
+        self.sample_shape = self.shape[1:]
+        self.sample_size = int(np.prod(self.sample_shape))
+
+    def validate(self, input_):
+        '''
+        Args:
+            input_ (list or numpy.ndarray): nested lists with the declared shape, or a flat list
+                holding one or many samples
+                Ex: [[5.1, 3.5, 1.4, 0.2]] or [5.1, 3.5, 1.4, 0.2]
+        Returns:
+            A C-contiguous array of the declared dtype and shape, with the batch size of the input
+        Raises:
+            InputError: the input does not match the declared dtype or shape
+        '''
+        try:
+            array = np.asarray(input_)
+        except ValueError as err:
+            raise InputError("Input must be nested lists of numbers with the same length: " + str(err))
+
+        if array.dtype.kind == 'O':
+            raise InputError("Input must be nested lists of numbers with the same length")
+        if array.dtype.kind in 'SU':
+            raise InputError("Input must hold numbers, not strings")
+        if array.dtype.kind not in ACCEPTED_KINDS[self.dtype.kind]:
+            raise InputError("Input of type '" + array.dtype.name + "' can not be converted to '" +
+                             self.dtype.name + "' without losing values")
+
+        # Flat lists are split in samples, like RedisAI does with the declared shape
+        if array.ndim == 1 and len(self.shape) > 1:
+            if array.size == 0 or array.size % self.sample_size:
+                raise InputError("Input has " + str(array.size) + " values, expected a multiple of " +
+                                 str(self.sample_size) + " for shape " + str(list(self.shape)))
+            array = array.reshape((-1,) + self.sample_shape)
+
+        if array.ndim != len(self.shape):
+            raise InputError("Input has " + str(array.ndim) + " dimensions, expected " + str(len(self.shape)) +
+                             " for shape " + str(list(self.shape)))
+        if array.shape[1:] != self.sample_shape or array.shape[0] < 1:
+            raise InputError("Input has shape " + str(list(array.shape)) + ", expected " +
+                             str(['batch'] + list(self.sample_shape)))
+
+        return np.ascontiguousarray(array, dtype=self.dtype)
+
+    def validate_sparse(self, matrix):
+        '''
+        Args:
+            matrix (scipy.sparse matrix): features returned by 'pre_process', one row per sample
+        Returns:
+            A CSR matrix of the declared dtype, without duplicate entries
+        Raises:
+            InputError: the matrix does not match the declared dtype or shape
+        '''
+        if len(self.shape) != 2:
+            raise InputError("Sparse input is only supported for shapes with 2 dimensions, got " +
+                             str(list(self.shape)))
+        if matrix.shape[1] != self.shape[1] or matrix.shape[0] < 1:
+            raise InputError("Input has shape " + str(list(matrix.shape)) + ", expected " +
+                             str(['batch'] + list(self.sample_shape)))
+        if matrix.dtype.kind not in ACCEPTED_KINDS[self.dtype.kind]:
+            raise InputError("Input of type '" + matrix.dtype.name + "' can not be converted to '" +
+                             self.dtype.name + "' without losing values")
+
+        matrix = matrix.tocsr().astype(self.dtype)
+        matrix.sum_duplicates()
+        return matrix
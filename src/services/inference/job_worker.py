@@ -0,0 +1,189 @@
+from inference import redis_client, load_model, run_frame, count_outputs, unregister_tensor, unregister_input, \
+    job_key, job_done_key, stage_timings, JOB_RESULT_TTL
+
+import os
+import json
+import time
+import logging
+import tracing
+import sharding
+
+logger = logging.getLogger(__name__)
+
+# Jobs taken by a worker stay in this list until their result is written,
+# so the jobs of a worker that crashed or restarted are not lost
+JOBS_PROCESSING = 'inference_jobs_processing'
+
+# Seconds after which a job still being processed is considered lost with its worker and is queued again.
+# Must be longer than the slowest job.
+JOB_RUNNING_TIMEOUT = float(os.environ.get('JOB_RUNNING_TIMEOUT', '300'))
+
+# Seconds between two checks of the processing list for lost jobs
+JOB_RECOVERY_INTERVAL = int(os.environ.get('JOB_RECOVERY_INTERVAL', '60'))
+
+# Seconds a worker waits before reading its queue again after an error (e.g. Redis restarting)
+JOB_WORKER_RETRY_INTERVAL = float(os.environ.get('JOB_WORKER_RETRY_INTERVAL', '1'))
+
+
+def run_job(job):
+    '''
+    Args:
+        job (dict): the job pushed to 'inference_jobs'
+            Ex: {"id": "<job_id>", "model": "iris", "version": "1", "frame": {"input": [[1, 2, 3, 4]]}}
+    Returns:
+        A mapping with the fields to store in the job hash
+    '''
+    model_name_redis = job['model'] + '/' + job['version']
+    input_label = job['model'] + "_" + job['version'] + "_job_" + job['id'] + "_input"
+    output_labels = []
+    model_client = None
+    try:
+        model, formatter = load_model(job['model'], job['version'])
+        model_client = sharding.model_client(model_name_redis, sharding.get_replicas(model))
+        output_labels = [job['model'] + "_" + job['version'] + "_job_" + job['id'] + "_output_" + str(i)
+                         for i in range(count_outputs(model))]
+
+        output_ = run_frame(model_name_redis,
+                            model,
+                            formatter,
+                            job['frame'],
+                            input_label,
+                            output_labels,
+                            model_client)
+        return {"status": "done", "output": json.dumps(output_)}
+
+    except OSError as err:
+        return {"status": "failed", "error": "Not Found", "message": "Model not loaded"}
+
+    except Exception as err:
+        logger.error("Job '%s' for model '%s' failed", job['id'], model_name_redis,
+                     extra={"event": "job_error", "job": job['id'], "model": model_name_redis, "error": str(err)})
+        return {"status": "failed", "error": type(err).__name__, "message": str(err)}
+
+    finally:
+        if model_client is not None:
+            unregister_input(model, input_label, model_client)
+            for label in output_labels:
+                unregister_tensor(label, model_client)
+
+
+def finish_job(job_id, result, raw_job):
+    result['finished_at'] = str(time.time())
+    pipeline = redis_client.pipeline()
+    pipeline.hset(job_key(job_id), mapping=result)
+    pipeline.expire(job_key(job_id), JOB_RESULT_TTL)
+    # Wakes up long-poll requests waiting for this job
+    pipeline.rpush(job_done_key(job_id), 1)
+    pipeline.expire(job_done_key(job_id), JOB_RESULT_TTL)
+    pipeline.lrem(JOBS_PROCESSING, 1, raw_job)
+    pipeline.execute()
+
+
+def process_job(raw_job):
+    job = json.loads(raw_job)
+
+    # Jobs queued for longer than JOB_RESULT_TTL expired, so nobody can fetch their result anymore
+    if not redis_client.exists(job_key(job['id'])):
+        logger.warning("Job '%s' expired before it was run", job['id'],
+                       extra={"event": "job_expired", "job": job['id'], "model": job['model'] + '/' + job['version']})
+        redis_client.lrem(JOBS_PROCESSING, 1, raw_job)
+        return
+
+    pipeline = redis_client.pipeline()
+    pipeline.hset(job_key(job['id']), mapping={"status": "running", "started_at": str(time.time())})
+    pipeline.expire(job_key(job['id']), JOB_RESULT_TTL)
+    pipeline.execute()
+
+    start = time.perf_counter()
+    stage_timings.set({})
+    with tracing.span('inference_job',
+                      tracing.parse_traceparent(job.get('traceparent')),
+                      job=job['id'],
+                      model=job['model'] + '/' + job['version']):
+        result = run_job(job)
+    finish_job(job['id'], result, raw_job)
+
+    # One summary per job, like the requests of the inference service
+    logger.info("Job '%s' %s", job['id'], result['status'],
+                extra={"event": "job",
+                       "job": job['id'],
+                       "model": job['model'] + '/' + job['version'],
+                       "status": result['status'],
+                       "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+                       "stages": {name: round(duration, 3) for name, duration in stage_timings.get().items()}})
+
+
+def fail_job(raw_job, err):
+    '''
+    Marks a job that could not be processed as 'failed', so long-poll requests stop waiting for it.
+    Jobs that are not valid JSON or already expired are only removed from the processing list.
+    '''
+    try:
+        job_id = json.loads(raw_job)['id']
+    except (ValueError, KeyError, TypeError):
+        job_id = None
+
+    if job_id is None or not redis_client.exists(job_key(job_id)):
+        redis_client.lrem(JOBS_PROCESSING, 1, raw_job)
+        return
+    finish_job(job_id, {"status": "failed", "error": type(err).__name__, "message": str(err)}, raw_job)
+
+
+def recover_jobs():
+    '''
+    Queues again the jobs processed for longer than JOB_RUNNING_TIMEOUT, left in the processing list
+    by a worker that crashed or restarted. Finished and expired jobs are only removed from it.
+
+    Returns:
+        The number of jobs queued again
+    '''
+    recovered = 0
+    for raw_job in redis_client.lrange(JOBS_PROCESSING, 0, -1):
+        try:
+            job = redis_client.hgetall(job_key(json.loads(raw_job)['id']))
+        except (ValueError, KeyError, TypeError):
+            job = {}
+        status = job.get(b'status', b'').decode('utf-8')
+
+        if status in ['queued', 'running']:
+            claimed_at = float(job.get(b'started_at', job.get(b'submitted_at', b'0')))
+            if time.time() - claimed_at < JOB_RUNNING_TIMEOUT:
+                continue
+            # Only the worker removing the job queues it again. The tail is read first, so it runs next.
+            if redis_client.lrem(JOBS_PROCESSING, 1, raw_job):
+                redis_client.rpush('inference_jobs', raw_job)
+                recovered += 1
+        else:
+            redis_client.lrem(JOBS_PROCESSING, 1, raw_job)
+
+    if recovered:
+        logger.warning("%d lost jobs queued again", recovered, extra={"event": "jobs_recovered", "jobs": recovered})
+    return recovered
+
+
+def process_jobs():
+    next_recovery = 0
+    while True:
+        raw_job = None
+        try:
+            if time.monotonic() >= next_recovery:
+                recover_jobs()
+                next_recovery = time.monotonic() + JOB_RECOVERY_INTERVAL
+
+            raw_job = redis_client.brpoplpush('inference_jobs', JOBS_PROCESSING, timeout=JOB_RECOVERY_INTERVAL)
+            if raw_job is not None:
+                process_job(raw_job)
+        except Exception as err:
+            # The worker must keep running: the job is marked as 'failed', or recovered later if Redis is down
+            logger.error("Could not process the next job", extra={"event": "job_queue_error", "error": str(err)})
+            if raw_job is not None:
+                try:
+                    fail_job(raw_job, err)
+                except Exception:
+                    pass
+            time.sleep(JOB_WORKER_RETRY_INTERVAL)
+
+
+# Each process is a single consumer of 'inference_jobs'. More consumers are more replicas.
+if __name__ == "__main__":
+    process_jobs()
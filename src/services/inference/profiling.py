@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import time
+import pstats
+import marshal
+import cProfile
+import threading
+
+# Workers check whether a model is being profiled at most once per interval, so requests
+# of models not being profiled cost a dict lookup only
+PROFILE_REFRESH_INTERVAL = float(os.environ.get('PROFILE_REFRESH_INTERVAL', '1'))
+
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', '0.005'))
+
+# Seconds profiles are kept after their session started
+PROFILE_RESULT_TTL = int(os.environ.get('PROFILE_RESULT_TTL', '3600'))
+
+PROFILE_MODES = ['sampling', 'deterministic']
+
+# model -> (checked_at, session), for this worker
+sessions_cache = {}
+
+# Takes one request of a session, or returns -1 once the session expired or was deleted,
+# so the counter is never written to a key without a TTL
+CLAIM_REQUEST_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+return redis.call('HINCRBY', KEYS[1], 'remaining', -1)
+"""
+
+
+def session_key(model):
+    return 'profile_session:' + model
+
+
+def results_key(model):
+    return 'profile_results:' + model
+
+
+def create_session(redis_client, model, mode, requests_count, seconds):
+    '''
+    Starts profiling the next 'requests_count' requests for a model, on every worker,
+    for at most 'seconds' seconds. Profiles of a previous session are discarded.
+
+    Args:
+        model (string): the model to profile
+            Ex: sentiment/1
+        mode (string): 'sampling' (collapsed stacks only) or 'deterministic' (cProfile as well)
+    '''
+    pipeline = redis_client.pipeline()
+    pipeline.delete(results_key(model))
+    pipeline.hset(session_key(model),
+                  mapping={"mode": mode,
+                           "remaining": requests_count,
+                           "started_at": str(time.time())})
+    pipeline.expire(session_key(model), seconds)
+    pipeline.execute()
+
+
+def delete_session(redis_client, model):
+    redis_client.delete(session_key(model))
+
+
+def get_session(redis_client, model):
+    checked_at, session = sessions_cache.get(model, (0, None))
+    if time.monotonic() - checked_at > PROFILE_REFRESH_INTERVAL:
+        session = {key.decode('utf-8'): value.decode('utf-8')
+                   for key, value in redis_client.hgetall(session_key(model)).items()}
+        sessions_cache[model] = (time.monotonic(), session)
+    return session
+
+
+class Sampler(threading.Thread):
+    '''
+    Samples the stack of a request thread, counting each stack as a 'collapsed' line
+    ('file:function;file:function'), the format read by flamegraph tools.
+    '''
+
+    def __init__(self, thread_id):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.stacks = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(PROFILE_SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(os.path.basename(frame.f_code.co_filename) + ':' + frame.f_code.co_name)
+                frame = frame.f_back
+            if stack:
+                collapsed = ';'.join(reversed(stack))
+                self.stacks[collapsed] = self.stacks.get(collapsed, 0) + 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def start_profiling(redis_client, model):
+    '''
+    Returns:
+        A profile to give to 'stop_profiling' if the request must be profiled, None otherwise
+    '''
+    session = get_session(redis_client, model)
+    if not session:
+        return None
+
+    # Requests are counted for the whole session, across workers
+    if redis_client.eval(CLAIM_REQUEST_SCRIPT, 1, session_key(model)) < 0:
+        sessions_cache[model] = (time.monotonic(), None)
+        return None
+
+    profile = {"model": model,
+               "start": time.perf_counter(),
+               "profiler": None,
+               "sampler": Sampler(threading.get_ident())}
+    profile['sampler'].start()
+    if session['mode'] == 'deterministic':
+        profile['profiler'] = cProfile.Profile()
+        profile['profiler'].enable()
+    return profile
+
+
+def stop_profiling(redis_client, profile):
+    duration = time.perf_counter() - profile['start']
+    stats = {}
+    if profile['profiler']:
+        profile['profiler'].disable()
+        profile['profiler'].create_stats()
+        stats = profile['profiler'].stats
+    profile['sampler'].stop()
+
+    pipeline = redis_client.pipeline()
+    pipeline.rpush(results_key(profile['model']),
+                   marshal.dumps({"duration": duration,
+                                  "stats": stats,
+                                  "stacks": profile['sampler'].stacks}))
+    pipeline.expire(results_key(profile['model']), PROFILE_RESULT_TTL)
+    pipeline.execute()
+
+
+# pstats.Stats only merges objects exposing 'create_stats' and 'stats', like cProfile.Profile
+class LoadedStats:
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def format_function(function):
+    file_name, line, name = function
+    return os.path.basename(file_name) + ':' + str(line) + '(' + name + ')'
+
+
+def get_profile(redis_client, model, limit=50):
+    '''
+    Aggregates the profiles of every request profiled for a model, by any worker.
+
+    Returns:
+        A dict with the profiled 'requests' and their 'durations', the 'functions' with the most
+        samples, the 'collapsed' stacks and, in deterministic mode, the cProfile 'stats' by
+        cumulative time with their callers
+    '''
+    results = [marshal.loads(result)
+               for result in redis_client.lrange(results_key(model), 0, -1)]
+
+    stacks = {}
+    functions = {}
+    merged_stats = pstats.Stats()
+    for result in results:
+        for stack, count in result['stacks'].items():
+            stacks[stack] = stacks.get(stack, 0) + count
+            frames = stack.split(';')
+            for frame in set(frames):
+                functions.setdefault(frame, {"function": frame, "self": 0, "total": 0})['total'] += count
+            functions[frames[-1]]['self'] += count
+        if result['stats']:
+            merged_stats.add(LoadedStats(result['stats']))
+
+    stats = []
+    for function, (primitive_calls, calls, total_time, cumulative_time, callers) in \
+            sorted(merged_stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]:
+        stats.append({"function": format_function(function),
+                      "calls": calls,
+                      "primitive_calls": primitive_calls,
+                      "total_time": total_time,
+                      "cumulative_time": cumulative_time,
+                      "callers": [format_function(caller) for caller in callers]})
+
+    session = {key.decode('utf-8'): value.decode('utf-8')
+               for key, value in redis_client.hgetall(session_key(model)).items()}
+
+    return {"active": bool(session) and int(session['remaining']) > 0,
+            "requests": len(results),
+            "durations": [result['duration'] for result in results],
+            "functions": sorted(functions.values(), key=lambda function: function['total'], reverse=True)[:limit],
+            "stats": stats,
+            "collapsed": '\n'.join(stack + ' ' + str(count)
+                                   for stack, count in sorted(stacks.items()))}
@@ -0,0 +1,183 @@
+import os
+import math
+import json
+import time
+import bisect
+import random
+
+# Workers read the routing rule of a model at most once per interval
+ROUTING_REFRESH_INTERVAL = float(os.environ.get('ROUTING_REFRESH_INTERVAL', '1'))
+
+# Numbers in the outputs of two versions agree when their relative (or absolute) difference is below it
+ROUTING_AGREEMENT_TOLERANCE = float(os.environ.get('ROUTING_AGREEMENT_TOLERANCE', '0.001'))
+
+# Upper bounds of the latency buckets, in milliseconds: from 0.5 ms to about 60 s, 20% apart
+LATENCY_BUCKETS = [round(0.5 * 1.2 ** i, 3) for i in range(65)]
+
+ROUTING_ROLES = ['primary', 'canary', 'shadow']
+
+# model -> (checked_at, rule), for this worker
+rules_cache = {}
+
+
+def rule_key(model_name):
+    return 'routing_rule:' + model_name
+
+
+def stats_key(model_name, role):
+    return 'routing_stats:' + model_name + ':' + role
+
+
+def validate_rule(rule):
+    '''
+    Args:
+        rule (dict): the routing rule of a model
+            Ex: {"version": "1", "canary": {"version": "2", "weight": 0.1}, "shadow": {"version": "3", "sample_rate": 0.5}}
+    Returns:
+        An error message, or None if the rule is valid
+    '''
+    if not isinstance(rule, dict) or not isinstance(rule.get('version'), str):
+        return "'version' must be the version serving the traffic, as a string"
+    if 'canary' in rule:
+        if not isinstance(rule['canary'], dict) or not isinstance(rule['canary'].get('version'), str):
+            return "'canary' must have a 'version' string"
+        weight = rule['canary'].get('weight')
+        if not isinstance(weight, (int, float)) or not 0 <= weight <= 1:
+            return "'canary.weight' must be a number between 0 and 1"
+    if 'shadow' in rule:
+        if not isinstance(rule['shadow'], dict) or not isinstance(rule['shadow'].get('version'), str):
+            return "'shadow' must have a 'version' string"
+        sample_rate = rule['shadow'].get('sample_rate', 1)
+        if not isinstance(sample_rate, (int, float)) or not 0 <= sample_rate <= 1:
+            return "'shadow.sample_rate' must be a number between 0 and 1"
+    return None
+
+
+def set_rule(redis_client, model_name, rule):
+    '''
+    Replaces the routing rule of a model. Statistics of the previous rule are discarded.
+    '''
+    pipeline = redis_client.pipeline()
+    pipeline.set(rule_key(model_name), json.dumps(rule))
+    pipeline.delete(*[stats_key(model_name, role) for role in ROUTING_ROLES])
+    pipeline.execute()
+    # Other workers see the new rule within ROUTING_REFRESH_INTERVAL
+    rules_cache.pop(model_name, None)
+
+
+def delete_rule(redis_client, model_name):
+    redis_client.delete(rule_key(model_name))
+    rules_cache.pop(model_name, None)
+
+
+def get_rule(redis_client, model_name):
+    checked_at, rule = rules_cache.get(model_name, (0, None))
+    if time.monotonic() - checked_at > ROUTING_REFRESH_INTERVAL:
+        rule = redis_client.get(rule_key(model_name))
+        rule = json.loads(rule) if rule else None
+        rules_cache[model_name] = (time.monotonic(), rule)
+    return rule
+
+
+def choose_version(rule):
+    '''
+    Returns:
+        A tuple with the version serving a request and its role ('primary' or 'canary')
+    '''
+    if 'canary' in rule and random.random() < rule['canary']['weight']:
+        return rule['canary']['version'], 'canary'
+    return rule['version'], 'primary'
+
+
+def should_mirror(rule):
+    return 'shadow' in rule and random.random() < rule['shadow'].get('sample_rate', 1)
+
+
+def record_latency(redis_client, model_name, role, duration, failed=False, agreed=None):
+    '''
+    Counts a request in the latency histogram of a role and, for shadow requests,
+    whether its output agreed with the one returned by the primary version.
+
+    Args:
+        duration (float): the request duration in milliseconds
+        agreed (bool): None when outputs were not compared
+    '''
+    bucket = bisect.bisect_left(LATENCY_BUCKETS, duration)
+    pipeline = redis_client.pipeline(transaction=False)
+    pipeline.hincrby(stats_key(model_name, role), 'requests', 1)
+    if failed:
+        pipeline.hincrby(stats_key(model_name, role), 'errors', 1)
+    else:
+        pipeline.hincrbyfloat(stats_key(model_name, role), 'total_ms', duration)
+        pipeline.hincrby(stats_key(model_name, role), 'bucket_' + str(bucket), 1)
+    if agreed is not None:
+        pipeline.hincrby(stats_key(model_name, role), 'compared', 1)
+        pipeline.hincrby(stats_key(model_name, role), 'agreed', int(agreed))
+    pipeline.execute()
+
+
+def outputs_agree(output, other_output):
+    if isinstance(output, dict) and isinstance(other_output, dict):
+        return output.keys() == other_output.keys() and \
+            all(outputs_agree(output[key], other_output[key]) for key in output)
+    if isinstance(output, list) and isinstance(other_output, list):
+        return len(output) == len(other_output) and \
+            all(outputs_agree(value, other_value) for value, other_value in zip(output, other_output))
+    if isinstance(output, (int, float)) and isinstance(other_output, (int, float)) and \
+            not isinstance(output, bool) and not isinstance(other_output, bool):
+        return math.isclose(output, other_output,
+                            rel_tol=ROUTING_AGREEMENT_TOLERANCE,
+                            abs_tol=ROUTING_AGREEMENT_TOLERANCE)
+    return output == other_output
+
+
+def get_percentile(buckets, count, percentile):
+    # Upper bound of the bucket holding the percentile (the last bound for slower requests)
+    seen = 0
+    for bucket, bucket_count in sorted(buckets.items()):
+        seen += bucket_count
+        if seen >= count * percentile:
+            return LATENCY_BUCKETS[min(bucket, len(LATENCY_BUCKETS) - 1)]
+    return None
+
+
+def summarize_stats(stats):
+    buckets = {int(field[len('bucket_'):]): int(value)
+               for field, value in stats.items()
+               if field.startswith('bucket_')}
+    measured = sum(buckets.values())
+    summary = {"requests": int(stats.get('requests', 0)),
+               "errors": int(stats.get('errors', 0)),
+               "mean_ms": round(float(stats.get('total_ms', 0)) / measured, 3) if measured else None,
+               "p50_ms": get_percentile(buckets, measured, 0.5),
+               "p95_ms": get_percentile(buckets, measured, 0.95),
+               "p99_ms": get_percentile(buckets, measured, 0.99)}
+    if 'compared' in stats:
+        summary['compared'] = int(stats['compared'])
+        summary['agreed'] = int(stats.get('agreed', 0))
+        summary['agreement'] = round(summary['agreed'] / summary['compared'], 4)
+    return summary
+
+
+def get_stats(redis_client, model_name):
+    '''
+    Returns:
+        The routing rule of a model and, for each version it routes to, its role with
+        its latency percentiles and, for the shadow version, its output agreement
+    '''
+    rule = redis_client.get(rule_key(model_name))
+    rule = json.loads(rule) if rule else None
+
+    versions = []
+    for role in ROUTING_ROLES:
+        stats = {key.decode('utf-8'): value.decode('utf-8')
+                 for key, value in redis_client.hgetall(stats_key(model_name, role)).items()}
+        if role == 'primary':
+            version = rule['version'] if rule else None
+        else:
+            version = rule[role]['version'] if rule and role in rule else None
+        if version is None and not stats:
+            continue
+        versions.append({"role": role, "version": version, **summarize_stats(stats)})
+
+    return {"rule": rule, "versions": versions}
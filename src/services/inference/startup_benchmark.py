@@ -0,0 +1,97 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import urllib.error
+import urllib.request
+
+SERVICE_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_server(preload, port, workers):
+    env = dict(os.environ, INFERENCE_PRELOAD='true' if preload else 'false')
+    return subprocess.Popen(['gunicorn', '-b', '127.0.0.1:' + str(port), 'wsgi:app', '-w', str(workers)],
+                            cwd=SERVICE_PATH,
+                            env=env,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+
+
+def wait_first_200(url, body, timeout):
+    '''
+    Returns:
+        The seconds until a GET of 'url' with the JSON 'body' answered with a 200, or None after 'timeout' seconds
+    '''
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        inference_request = urllib.request.Request(url,
+                                                   data=body.encode('utf-8'),
+                                                   headers={"Content-Type": "application/json"},
+                                                   method='GET')
+        try:
+            with urllib.request.urlopen(inference_request) as response:
+                if response.status == 200:
+                    return time.perf_counter() - start
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.05)
+    return None
+
+
+def read_memory(pid):
+    '''
+    Returns:
+        The RSS, PSS and USS (private pages) of a process, in MiB. Pages shared copy-on-write
+        with the master count fully in the RSS of every worker, so the PSS and USS show the sharing.
+    '''
+    fields = {}
+    with open('/proc/' + str(pid) + '/smaps_rollup') as smaps:
+        for line in smaps:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {"rss_mib": round(fields['Rss'] / 1024, 1),
+            "pss_mib": round(fields['Pss'] / 1024, 1),
+            "uss_mib": round((fields['Private_Clean'] + fields['Private_Dirty']) / 1024, 1)}
+
+
+def get_workers(master_pid):
+    with open('/proc/' + str(master_pid) + '/task/' + str(master_pid) + '/children') as children:
+        return [int(pid) for pid in children.read().split()]
+
+
+def measure(preload, port, workers, path, body, timeout):
+    server = start_server(preload, port, workers)
+    try:
+        first_200 = wait_first_200('http://127.0.0.1:' + str(port) + path, body, timeout)
+        # Every worker serves a few requests, so the pages they touch are counted
+        for _ in range(workers * 4):
+            wait_first_200('http://127.0.0.1:' + str(port) + path, body, timeout)
+        return {"preload": preload,
+                "first_200_s": round(first_200, 3) if first_200 is not None else None,
+                "master": read_memory(server.pid),
+                "workers": [read_memory(pid) for pid in get_workers(server.pid)]}
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares the cold start and worker memory of the inference service with and without preload")
+    parser.add_argument('--path', default='/inference/iris/1/',
+                        help="an inference endpoint answering with a 200 once the service is ready")
+    parser.add_argument('--body', default='{"input": [[5.1, 3.5, 1.4, 0.2]]}',
+                        help="the JSON sent to the endpoint")
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+
+    if not sys.platform.startswith('linux'):
+        sys.exit("Memory is read from /proc, so this script only runs on Linux")
+
+    print(json.dumps([measure(preload, args.port, args.workers, args.path, args.body, args.timeout)
+                      for preload in (False, True)], indent=4))
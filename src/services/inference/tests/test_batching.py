@@ -0,0 +1,82 @@
+import time
+
+import numpy as np
+import pytest
+
+import batching
+
+
+def start_batcher(run_batch, max_batch_size=32, max_wait=0.05, idle_timeout=5):
+    batcher = batching.InputBatcher(run_batch, max_batch_size, max_wait, idle_timeout)
+    batcher.start()
+    return batcher
+
+
+def test_outputs_are_split_by_input_rows():
+    batch_sizes = []
+
+    def run_batch(batch):
+        batch_sizes.append(batch.shape[0])
+        return [batch * 2, batch.sum(axis=1)]
+
+    batcher = start_batcher(run_batch)
+    inputs = [np.full((rows, 2), rows, dtype=np.float32) for rows in (1, 3, 2)]
+    futures = [batcher.submit(input_) for input_ in inputs]
+
+    for input_, future in zip(inputs, futures):
+        doubled, sums = future.result(timeout=5)
+        np.testing.assert_array_equal(doubled, input_ * 2)
+        np.testing.assert_array_equal(sums, input_.sum(axis=1))
+    assert sum(batch_sizes) == 6
+
+
+def test_batches_stop_at_max_batch_size():
+    batch_sizes = []
+
+    def run_batch(batch):
+        batch_sizes.append(batch.shape[0])
+        return [batch]
+
+    batcher = start_batcher(run_batch, max_batch_size=2, max_wait=0.2)
+    futures = [batcher.submit(np.zeros((1, 2))) for _ in range(4)]
+
+    for future in futures:
+        future.result(timeout=5)
+    assert max(batch_sizes) == 2
+
+
+def test_errors_reach_every_future_of_the_batch():
+    def run_batch(batch):
+        raise RuntimeError("model failed")
+
+    batcher = start_batcher(run_batch)
+    futures = [batcher.submit(np.zeros((1, 2))) for _ in range(2)]
+
+    for future in futures:
+        with pytest.raises(RuntimeError, match="model failed"):
+            future.result(timeout=5)
+    assert batcher.is_alive()
+
+
+def test_invalid_inputs_do_not_stop_the_thread():
+    batcher = start_batcher(lambda batch: [batch])
+
+    with pytest.raises(AttributeError):
+        batcher.submit([[1, 2]]).result(timeout=5)
+    np.testing.assert_array_equal(batcher.submit(np.ones((1, 2))).result(timeout=5)[0], [[1, 1]])
+
+
+def test_idle_batchers_stop():
+    batcher = start_batcher(lambda batch: [batch], idle_timeout=0.05)
+
+    batcher.join(timeout=5)
+
+    assert batcher.stopped
+    assert batcher.submit(np.ones((1, 2))) is None
+
+
+def test_inputs_are_run_before_the_idle_timeout():
+    batcher = start_batcher(lambda batch: [batch], idle_timeout=0.2)
+
+    time.sleep(0.1)
+    assert batcher.submit(np.ones((1, 2))).result(timeout=5)[0].shape == (1, 2)
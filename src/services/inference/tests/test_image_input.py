@@ -0,0 +1,49 @@
+import io
+
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+pytest.importorskip('PIL')
+
+from PIL import Image
+
+import image_input
+import input_validation
+
+
+def png_file(height=8, width=6):
+    image_file = io.BytesIO()
+    Image.fromarray(np.full((height, width, 3), 200, dtype=np.uint8)).save(image_file, format='PNG')
+    image_file.seek(0)
+    return image_file
+
+
+def test_images_are_resized_into_one_batch():
+    images = image_input.read_images([png_file(), png_file(16, 12)], [4, 3])
+
+    assert [image.shape for image in images] == [(4, 3, 3), (4, 3, 3)]
+    assert images[0][0, 0, 0] == 200
+
+
+def test_corrupt_images_are_input_errors():
+    with pytest.raises(input_validation.InputError, match="could not be decoded"):
+        image_input.read_images([io.BytesIO(b'not an image')], [4, 3])
+
+
+def test_requests_with_too_many_images_are_rejected(monkeypatch):
+    monkeypatch.setattr(image_input, 'IMAGE_MAX_COUNT', 2)
+
+    with pytest.raises(input_validation.InputError, match="3 images, at most 2"):
+        image_input.read_images([png_file() for _ in range(3)], [4, 3])
+
+
+def test_buffers_above_the_cap_are_not_kept(monkeypatch):
+    monkeypatch.setattr(image_input, 'IMAGE_BUFFER_MAX_BYTES', 4 * 3 * 3)
+
+    kept = image_input.get_batch_buffer([4, 3], 1)
+    assert image_input.get_batch_buffer([4, 3], 1).base is kept.base
+
+    large = image_input.get_batch_buffer([4, 3], 2)
+    assert large.shape == (2, 4, 3, 3)
+    assert image_input.get_batch_buffer([4, 3], 1).base is kept.base
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import input_validation
+
+
+@pytest.fixture
+def validator():
+    return input_validation.TensorValidator({"type": "number", "dtype": "float", "shape": [1, 4]})
+
+
+def test_float_is_sent_as_float32(validator):
+    array = validator.validate([[5.1, 3.5, 1.4, 0.2]])
+
+    assert array.dtype == np.float32
+    assert array.flags['C_CONTIGUOUS']
+
+
+def test_flat_lists_are_split_in_samples(validator):
+    assert validator.validate([1, 2, 3, 4, 5, 6, 7, 8]).shape == (2, 4)
+
+
+def test_batches_of_any_size_are_accepted(validator):
+    assert validator.validate(np.zeros((3, 4))).shape == (3, 4)
+
+
+@pytest.mark.parametrize('input_, message', [
+    ([[1, 2, 3]], "expected \\['batch', 4\\]"),
+    ([1, 2, 3], "expected a multiple of 4"),
+    ([[[1, 2, 3, 4]]], "3 dimensions"),
+    ([["a", "b", "c", "d"]], "not strings"),
+    ([[1, 2], [3]], "same length"),
+    ([], "expected a multiple of 4"),
+])
+def test_invalid_inputs_are_rejected(validator, input_, message):
+    with pytest.raises(input_validation.InputError, match=message):
+        validator.validate(input_)
+
+
+def test_lossy_conversions_are_rejected():
+    validator = input_validation.TensorValidator({"type": "number", "dtype": "int32", "shape": [1, 2]})
+
+    assert validator.validate([[1, 2]]).dtype == np.int32
+    with pytest.raises(input_validation.InputError, match="without losing values"):
+        validator.validate([[1.5, 2]])
+
+
+def test_unsupported_dtypes_are_descriptor_errors():
+    with pytest.raises(input_validation.DescriptorError, match="'complex64' is not supported"):
+        input_validation.TensorValidator({"type": "number", "dtype": "complex64", "shape": [1, 2]})
+
+
+def test_sparse_inputs_are_converted_to_csr_without_duplicates(validator):
+    scipy_sparse = pytest.importorskip('scipy.sparse')
+    matrix = scipy_sparse.coo_matrix(([1.0, 2.0, 3.0], ([0, 0, 1], [1, 1, 3])), shape=(2, 4))
+
+    csr_matrix = validator.validate_sparse(matrix)
+
+    assert csr_matrix.format == 'csr'
+    assert csr_matrix.dtype == np.float32
+    assert csr_matrix.nnz == 2
+    np.testing.assert_array_equal(csr_matrix.toarray(), [[0, 3, 0, 0], [0, 0, 0, 3]])
+
+
+@pytest.mark.parametrize('shape, dtype, message', [
+    ((2, 3), np.float64, "expected \\['batch', 4\\]"),
+    ((0, 4), np.float64, "expected \\['batch', 4\\]"),
+    ((2, 4), np.complex128, "without losing values"),
+])
+def test_invalid_sparse_inputs_are_rejected(validator, shape, dtype, message):
+    scipy_sparse = pytest.importorskip('scipy.sparse')
+
+    with pytest.raises(input_validation.InputError, match=message):
+        validator.validate_sparse(scipy_sparse.csr_matrix(shape, dtype=dtype))
+
+
+def test_sparse_inputs_need_two_dimensions():
+    scipy_sparse = pytest.importorskip('scipy.sparse')
+    validator = input_validation.TensorValidator({"type": "number", "dtype": "float", "shape": [1, 2, 2]})
+
+    with pytest.raises(input_validation.InputError, match="only supported for shapes with 2 dimensions"):
+        validator.validate_sparse(scipy_sparse.csr_matrix((1, 4)))
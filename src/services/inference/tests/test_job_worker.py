@@ -0,0 +1,116 @@
+import json
+import time
+
+import pytest
+
+import job_worker
+
+
+class StopWorker(BaseException):
+    pass
+
+
+class JobsClient:
+    def __init__(self):
+        self.lists = {}
+        self.hashes = {}
+        self.errors = []
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+    def exists(self, key):
+        if self.errors:
+            raise self.errors.pop(0)
+        return key in self.hashes
+
+    def hset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update({field.encode(): str(value).encode() for field, value in mapping.items()})
+
+    def hgetall(self, key):
+        return self.hashes.get(key, {})
+
+    def expire(self, key, ttl):
+        pass
+
+    def rpush(self, key, *values):
+        self.lists.setdefault(key, []).extend(values)
+
+    def lpush(self, key, *values):
+        self.lists[key] = list(reversed(values)) + self.lists.get(key, [])
+
+    def lrange(self, key, start, end):
+        return list(self.lists.get(key, []))
+
+    def lrem(self, key, count, value):
+        if value in self.lists.get(key, []):
+            self.lists[key].remove(value)
+            return 1
+        return 0
+
+    def brpoplpush(self, source, destination, timeout):
+        if not self.lists.get(source):
+            raise StopWorker()
+        value = self.lists[source].pop()
+        self.lists.setdefault(destination, []).insert(0, value)
+        return value
+
+
+def queue_job(client, job_id, **fields):
+    raw_job = json.dumps({"id": job_id, "model": "iris", "version": "1", "frame": {"input": [[1, 2, 3, 4]]}})
+    client.hset(job_worker.job_key(job_id), {"status": "queued", "submitted_at": time.time(), **fields})
+    client.lpush('inference_jobs', raw_job)
+    return raw_job
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = JobsClient()
+    monkeypatch.setattr(job_worker, 'redis_client', client)
+    monkeypatch.setattr(job_worker, 'JOB_WORKER_RETRY_INTERVAL', 0)
+    monkeypatch.setattr(job_worker, 'run_job', lambda job: {"status": "done", "output": json.dumps({"id": job['id']})})
+    return client
+
+
+def test_jobs_leave_the_processing_list_once_their_result_is_written(client):
+    queue_job(client, 'a')
+    queue_job(client, 'b')
+
+    with pytest.raises(StopWorker):
+        job_worker.process_jobs()
+
+    assert client.lists[job_worker.JOBS_PROCESSING] == []
+    for job_id in ['a', 'b']:
+        assert client.hashes[job_worker.job_key(job_id)][b'status'] == b'done'
+        assert client.lists[job_worker.job_done_key(job_id)] == [1]
+
+
+def test_errors_outside_run_job_fail_the_job_and_keep_the_worker_running(client):
+    queue_job(client, 'a')
+    queue_job(client, 'b')
+    client.errors.append(ConnectionError("connection reset"))
+
+    with pytest.raises(StopWorker):
+        job_worker.process_jobs()
+
+    failed = client.hashes[job_worker.job_key('a')]
+    assert failed[b'status'] == b'failed'
+    assert failed[b'message'] == b'connection reset'
+    assert client.lists[job_worker.job_done_key('a')] == [1]
+    assert client.hashes[job_worker.job_key('b')][b'status'] == b'done'
+    assert client.lists[job_worker.JOBS_PROCESSING] == []
+
+
+def test_lost_jobs_are_queued_again(client):
+    lost = queue_job(client, 'lost', status='running', started_at=time.time() - job_worker.JOB_RUNNING_TIMEOUT - 1)
+    running = queue_job(client, 'running', status='running', started_at=time.time())
+    finished = queue_job(client, 'finished', status='done')
+    client.lists[job_worker.JOBS_PROCESSING] = [lost, running, finished]
+    client.lists['inference_jobs'] = []
+
+    assert job_worker.recover_jobs() == 1
+    assert client.lists['inference_jobs'] == [lost]
+    assert client.lists[job_worker.JOBS_PROCESSING] == [running]
@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+import routing
+
+
+@pytest.mark.parametrize('rule', [
+    {"version": "1"},
+    {"version": "1", "canary": {"version": "2", "weight": 0.1}},
+    {"version": "1", "shadow": {"version": "3"}},
+    {"version": "1", "canary": {"version": "2", "weight": 1}, "shadow": {"version": "3", "sample_rate": 0}},
+])
+def test_validate_rule_accepts_valid_rules(rule):
+    assert routing.validate_rule(rule) is None
+
+
+@pytest.mark.parametrize('rule', [
+    None,
+    {"version": 1},
+    {"version": "1", "canary": {"weight": 0.1}},
+    {"version": "1", "canary": {"version": "2", "weight": 1.5}},
+    {"version": "1", "canary": {"version": "2"}},
+    {"version": "1", "shadow": {"version": "3", "sample_rate": -1}},
+])
+def test_validate_rule_rejects_invalid_rules(rule):
+    assert routing.validate_rule(rule)
+
+
+def test_choose_version_sends_the_canary_weight_to_the_canary(monkeypatch):
+    rule = {"version": "1", "canary": {"version": "2", "weight": 0.25}}
+
+    monkeypatch.setattr(routing.random, 'random', lambda: 0.2)
+    assert routing.choose_version(rule) == ('2', 'canary')
+    monkeypatch.setattr(routing.random, 'random', lambda: 0.3)
+    assert routing.choose_version(rule) == ('1', 'primary')
+    assert routing.choose_version({"version": "1"}) == ('1', 'primary')
+
+
+def test_should_mirror_follows_the_sample_rate(monkeypatch):
+    monkeypatch.setattr(routing.random, 'random', lambda: 0.5)
+
+    assert not routing.should_mirror({"version": "1"})
+    assert routing.should_mirror({"version": "1", "shadow": {"version": "2"}})
+    assert not routing.should_mirror({"version": "1", "shadow": {"version": "2", "sample_rate": 0.4}})
+
+
+@pytest.mark.parametrize('output, other_output, agreed', [
+    ({"iris": 1}, {"iris": 1}, True),
+    ({"score": 0.5}, {"score": 0.5000001}, True),
+    ({"score": 0.5}, {"score": 0.6}, False),
+    ({"labels": [1, 2]}, {"labels": [1, 2, 3]}, False),
+    ({"iris": 1}, {"setosa": 1}, False),
+    ({"sentiment": "good"}, {"sentiment": "good"}, True),
+])
+def test_outputs_agree(output, other_output, agreed):
+    assert routing.outputs_agree(output, other_output) == agreed
+
+
+def test_summarize_stats_reads_percentiles_from_buckets():
+    bucket = 10
+    stats = {"requests": "11", "errors": "1", "total_ms": "30",
+             "bucket_" + str(bucket): "9", "bucket_" + str(len(routing.LATENCY_BUCKETS)): "1"}
+
+    summary = routing.summarize_stats(stats)
+
+    assert summary['requests'] == 11
+    assert summary['errors'] == 1
+    assert summary['mean_ms'] == 3.0
+    assert summary['p50_ms'] == routing.LATENCY_BUCKETS[10]
+    # Requests slower than the last bucket report its bound, so the summary stays valid JSON
+    assert summary['p99_ms'] == routing.LATENCY_BUCKETS[-1]
+    json.dumps(summary, allow_nan=False)
+
+
+class RuleClient:
+    def __init__(self):
+        self.values = {}
+        self.reads = 0
+
+    def get(self, key):
+        self.reads += 1
+        return self.values.get(key)
+
+
+def test_get_rule_is_cached_for_the_refresh_interval(monkeypatch):
+    monkeypatch.setattr(routing, 'rules_cache', {})
+    monkeypatch.setattr(routing, 'ROUTING_REFRESH_INTERVAL', 60)
+    redis_client = RuleClient()
+    redis_client.values[routing.rule_key('iris')] = json.dumps({"version": "1"})
+
+    assert routing.get_rule(redis_client, 'iris') == {"version": "1"}
+    assert routing.get_rule(redis_client, 'iris') == {"version": "1"}
+    assert redis_client.reads == 1
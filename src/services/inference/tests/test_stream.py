@@ -0,0 +1,64 @@
+import json
+import threading
+
+import pytest
+
+import inference
+
+MODEL = {"backend": {"type": "onnx",
+                     "parameters": {"input": {"type": "number"}, "output": {"shape": [1, 1]}}}}
+
+
+@pytest.fixture(autouse=True)
+def echo_frames(monkeypatch):
+    monkeypatch.setattr(inference.sharding, 'model_client', lambda model_key, replicas: None)
+    monkeypatch.setattr(inference, 'unregister_input', lambda model, input_label, model_client: None)
+    monkeypatch.setattr(inference, 'unregister_tensor', lambda label, model_client: None)
+    monkeypatch.setattr(inference, 'run_frame',
+                        lambda model_name_redis, model, formatter, frame, input_label, output_labels, model_client:
+                        {"echo": frame['input']})
+
+
+def test_each_result_is_sent_before_the_next_frame_is_read():
+    first_result = threading.Event()
+    waited = []
+
+    def lines():
+        yield json.dumps({"input": 0}) + "\n"
+        # A client waiting for each reply before it sends the next frame
+        waited.append(first_result.wait(timeout=5))
+        yield json.dumps({"input": 1}) + "\n"
+
+    results = []
+    for line in inference.stream_inference('iris', '1', MODEL, None, lines()):
+        results.append(json.loads(line))
+        first_result.set()
+
+    assert waited == [True]
+    assert results == [{"sequence": 0, "output": {"echo": 0}}, {"sequence": 1, "output": {"echo": 1}}]
+
+
+def test_results_keep_the_order_of_the_frames():
+    lines = [json.dumps({"input": i}) + "\n" for i in range(10)] + ["\n", "not json\n"]
+
+    results = [json.loads(line) for line in inference.stream_inference('iris', '1', MODEL, None, lines)]
+
+    assert [result['sequence'] for result in results] == list(range(10)) + [11]
+    assert results[-1]['error'] == 'ValueError'
+
+
+def test_closing_the_session_stops_the_reader():
+    reader_done = threading.Event()
+
+    def lines():
+        try:
+            for i in range(100):
+                yield json.dumps({"input": i}) + "\n"
+        finally:
+            reader_done.set()
+
+    stream = inference.stream_inference('iris', '1', MODEL, None, lines())
+    next(stream)
+    stream.close()
+
+    assert reader_done.wait(timeout=5)
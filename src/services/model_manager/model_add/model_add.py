@@ -1,9 +1,14 @@
-from ml2rt import load_model
+from warmup import model_info_key, set_model_status, warmup_model
+from contextlib import contextmanager
 
 import os
+import time
+import mmap
 import json
 import logging
-import redisai
+import tracing
+import sharding
+import structured_logging
 
 MODELS_PATH = os.environ['MODELS_ROOT_PATH']
 
@@ -20,57 +25,127 @@ redis_backend = {"tensorflow": "TF",
                  "pytorch": "TORCH",
                  "onnx": "ONNX"}
 
-logging.basicConfig(format='%(message)s', level=logging.INFO)
+structured_logging.setup_logging()
 logger = logging.getLogger(__name__)
 
-redis_client = redisai.Client(host='redisai', port=6379)
+# Queues and model status. Models are set on the nodes chosen by 'sharding'.
+redis_client = sharding.control_client
 
+# Seconds the consumer waits before reading 'models_to_add' again after an error (e.g. RedisAI restarting)
+MODEL_ADD_RETRY_INTERVAL = float(os.environ.get('MODEL_ADD_RETRY_INTERVAL', '1'))
 
-def add_model_to_redis():
-    try:
-        while True:
-            new_model = redis_client.blpop('models_to_add')[1].decode('utf-8')
 
-            logger.info("New model to add: '" + new_model + "'")
+# Maps the model file instead of reading it into a bytes object. redis-py sends memoryviews
+# straight to the socket, so the model is never fully copied into the process memory.
+@contextmanager
+def load_model(model_file):
+    with open(model_file, 'rb') as file:
+        mapped_model = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        model_view = memoryview(mapped_model)
+        try:
+            yield model_view
+        finally:
+            model_view.release()
+            try:
+                mapped_model.close()
+            except BufferError:
+                # Slices taken by redis-py are still referenced by the traceback of a failed 'modelset',
+                # so the mapping is closed once they are garbage collected and the real error is raised
+                pass
+
+
+def add_model(new_model):
+    '''
+    Sets a model version on its RedisAI nodes, warms it up and marks it as 'ready'.
+
+    Args:
+        new_model (string): the model version to add
+            Ex: iris/1
+    '''
+    start = time.perf_counter()
+    logger.debug("New model to add: '%s'", new_model, extra={"event": "model_received", "model": new_model})
 
-            [model_name, model_version] = new_model.split('/')
+    [model_name, model_version] = new_model.split('/')
 
-            model_path = os.path.join(MODELS_PATH,
-                                      model_name,
-                                      model_version)
+    model_path = os.path.join(MODELS_PATH,
+                              model_name,
+                              model_version)
 
-            json_path = os.path.join(model_path, model_name + ".json")
+    json_path = os.path.join(model_path, model_name + ".json")
 
-            if os.path.isfile(json_path):
-                with open(json_path) as json_file:
-                    model_data = json.load(json_file)
-                    model = model_data['model']
+    with open(json_path) as json_file:
+        model_data = json.load(json_file)
+        model = model_data['model']
 
-            model_file = os.path.join(model_path,
-                                      model_name +
-                                      '.' +
-                                      model_extensions[model['backend']['type']])
+    model_file = os.path.join(model_path,
+                              model_name +
+                              '.' +
+                              model_extensions[model['backend']['type']])
 
-            logger.info("Loading model: '" + new_model + "'")
-            loaded_model = load_model(model_file)
+    set_model_status(redis_client, new_model, 'loading')
 
-            logger.info("Model '" + new_model +
-                        "' loaded. Registering model in RedisAI...")
+    # Hot models may ask for more replicas, spreading their requests over more nodes
+    model_nodes = sharding.model_nodes(new_model, sharding.get_replicas(model))
 
+    with load_model(model_file) as loaded_model, tracing.span('modelset', nodes=len(model_nodes)):
+        for node in model_nodes:
             if (model['backend']['type'] == 'tensorflow'):
-                redis_client.modelset(new_model,
-                                      redis_backend[model['backend']['type']],
-                                      'CPU',
-                                      inputs=model['backend']['parameters']['input']['labels'],
-                                      outputs=model['backend']['parameters']['output']['labels'],
-                                      data=loaded_model)
+                sharding.clients[node].modelset(new_model,
+                                                redis_backend[model['backend']['type']],
+                                                'CPU',
+                                                inputs=model['backend']['parameters']['input']['labels'],
+                                                outputs=model['backend']['parameters']['output']['labels'],
+                                                data=loaded_model)
             else:
-                redis_client.modelset(new_model,
-                                      model_extensions[model['backend']
-                                                       ['type']],
-                                      'CPU',
-                                      loaded_model)
-
-            logger.info("New model added to RedisAI: '" + new_model + "'")
+                sharding.clients[node].modelset(new_model,
+                                                model_extensions[model['backend']
+                                                                 ['type']],
+                                                'CPU',
+                                                loaded_model)
+
+    modelset_ms = (time.perf_counter() - start) * 1000
+
+    set_model_status(redis_client, new_model, 'warming_up')
+    with tracing.span('warmup'):
+        # Every replica is warmed up; the profile of the first one is kept
+        profiles = [warmup_model(sharding.clients[node], new_model, model, model_path)
+                    for node in model_nodes]
+    if profiles[0] is not None:
+        redis_client.hset(model_info_key(new_model), 'profile', json.dumps(profiles[0]))
+    set_model_status(redis_client, new_model, 'ready', nodes=','.join(model_nodes))
+
+    # One summary per model instead of a line per registration step
+    logger.info("Model '%s' is ready", new_model,
+                extra={"event": "model_ready",
+                       "model": new_model,
+                       "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+                       "stages": {"modelset": round(modelset_ms, 3),
+                                  "warmup": round((time.perf_counter() - start) * 1000 - modelset_ms, 3)}})
+
+
+def add_next_model():
+    new_model, parent = tracing.extract(redis_client.blpop('models_to_add')[1].decode('utf-8'))
+    registration_span, token = tracing.start_span('model_add', parent)
+    registration_span.set('model', new_model)
+
+    error = None
+    try:
+        add_model(new_model)
     except Exception as err:
-        logger.error("Error during model registration to RedisAI: " + str(err))
+        # A bad version is marked as 'failed' instead of staying 'loading' or 'warming_up'
+        error = err
+        logger.error("Error during registration of model '%s' to RedisAI", new_model,
+                     extra={"event": "model_add_error", "model": new_model, "error": str(err)})
+        set_model_status(redis_client, new_model, 'failed', error=str(err))
+    finally:
+        tracing.end_span(registration_span, token, error)
+
+
+def add_model_to_redis():
+    # Errors must not stop the consumer for good, or every later registration would be ignored
+    while True:
+        try:
+            add_next_model()
+        except Exception as err:
+            logger.error("Could not read the models to add", extra={"event": "model_queue_error", "error": str(err)})
+            time.sleep(MODEL_ADD_RETRY_INTERVAL)
@@ -0,0 +1,81 @@
+from model_add import MODELS_PATH, redis_client
+from warmup import model_info_key
+
+import os
+import json
+import logging
+import argparse
+import tracing
+import sharding
+
+logger = logging.getLogger(__name__)
+
+
+def get_registered_models(redis_client):
+    '''
+    Returns:
+        The model versions with a 'model_info' hash, sorted
+            Ex: ['iris/1', 'sentiment/1']
+    '''
+    return sorted(model_info.decode('utf-8')[len(model_info_key('')):]
+                  for model_info in redis_client.scan_iter(match=model_info_key('*')))
+
+
+def get_model_replicas(model_key):
+    model_name, model_version = model_key.split('/')
+    json_path = os.path.join(MODELS_PATH, model_name, model_version, model_name + ".json")
+    with open(json_path) as json_file:
+        return sharding.get_replicas(json.load(json_file)['model'])
+
+
+def rebalance_models(prune=False):
+    '''
+    Moves every registered model version to the nodes the ring assigns it to, after REDISAI_NODES
+    (or the replicas of a model) changed. Versions missing from any of their nodes are queued to
+    'models_to_add' again. Until model_add set them there, requests keep going to the nodes recorded
+    in 'model_info' (see 'sharding.get_holders'). Copies left on other nodes are only deleted with
+    'prune', once every assigned node holds the version and model_add recorded them in 'model_info'.
+
+    Returns:
+        One report per model version, with its assigned 'nodes', the nodes it is 'missing' from
+        and the 'stale' nodes still holding it
+    '''
+    reports = []
+    for model_key in get_registered_models(redis_client):
+        try:
+            model_nodes = sharding.model_nodes(model_key, get_model_replicas(model_key))
+        except OSError as err:
+            logger.error("Descriptor of model '%s' not found", model_key,
+                         extra={"event": "rebalance_error", "model": model_key, "error": str(err)})
+            continue
+
+        holders = [node for node, node_client in sharding.clients.items() if node_client.exists(model_key)]
+        report = {"model": model_key,
+                  "nodes": model_nodes,
+                  "missing": [node for node in model_nodes if node not in holders],
+                  "stale": [node for node in holders if node not in model_nodes]}
+
+        # Stale copies keep serving requests until model_add recorded the new nodes in 'model_info'
+        recorded_nodes = (redis_client.hget(model_info_key(model_key), 'nodes') or b'').decode('utf-8')
+        if report['missing']:
+            redis_client.lpush('models_to_add', tracing.inject(model_key))
+        elif prune and sorted(recorded_nodes.split(',')) == sorted(model_nodes):
+            for node in report['stale']:
+                sharding.clients[node].delete(model_key)
+
+        logger.info("Model '%s': %d missing, %d stale", model_key, len(report['missing']), len(report['stale']),
+                    extra={"event": "rebalance", **report})
+        reports.append(report)
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Moves the registered model versions to the RedisAI nodes set in REDISAI_NODES")
+    parser.add_argument('--prune', action='store_true',
+                        help="delete copies held by nodes the versions no longer belong to")
+    args = parser.parse_args()
+
+    with tracing.span('rebalance'):
+        reports = rebalance_models(args.prune)
+    print(json.dumps(reports, indent=4))
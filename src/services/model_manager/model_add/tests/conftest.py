@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Modules of the service and the shared ones are imported by name, as in its container
+SERVICES_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.insert(0, os.path.join(SERVICES_PATH, 'common'))
+sys.path.insert(0, os.path.join(SERVICES_PATH, 'model_manager', 'model_add'))
+
+os.environ.setdefault('MODELS_ROOT_PATH', '/models')
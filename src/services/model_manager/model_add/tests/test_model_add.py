@@ -0,0 +1,70 @@
+import pytest
+
+import model_add
+import warmup
+
+
+class StopConsumer(BaseException):
+    pass
+
+
+class StatusClient:
+    def __init__(self, queue):
+        self.queue = list(queue)
+        self.hashes = {}
+
+    def blpop(self, key):
+        if not self.queue:
+            raise StopConsumer()
+        item = self.queue.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        return key.encode('utf-8'), item.encode('utf-8')
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        self.hashes.setdefault(key, {}).update(mapping or {field: value})
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self.hashes.get(key, {}).pop(field, None)
+
+
+@pytest.fixture
+def redis_client(monkeypatch, tmp_path):
+    monkeypatch.setattr(model_add, 'MODELS_PATH', str(tmp_path))
+    monkeypatch.setattr(model_add, 'MODEL_ADD_RETRY_INTERVAL', 0)
+
+    def install(queue):
+        client = StatusClient(queue)
+        monkeypatch.setattr(model_add, 'redis_client', client)
+        return client
+    return install
+
+
+def test_failed_registrations_are_marked_and_the_consumer_keeps_running(redis_client):
+    client = redis_client([ConnectionError("node restarting"), 'missing/1', 'other/1'])
+
+    with pytest.raises(StopConsumer):
+        model_add.add_model_to_redis()
+
+    for model in ['missing/1', 'other/1']:
+        assert client.hashes['model_info:' + model]['status'] == 'failed'
+        assert 'No such file' in client.hashes['model_info:' + model]['error']
+
+
+def test_loading_again_clears_the_previous_registration():
+    client = StatusClient([])
+    client.hashes['model_info:iris/1'] = {'status': 'ready', 'nodes': 'n0:6379', 'profile': '{}', 'error': 'old'}
+
+    warmup.set_model_status(client, 'iris/1', 'loading')
+
+    assert client.hashes['model_info:iris/1']['status'] == 'loading'
+    assert client.hashes['model_info:iris/1']['nodes'] == 'n0:6379'
+    assert 'profile' not in client.hashes['model_info:iris/1']
+    assert 'error' not in client.hashes['model_info:iris/1']
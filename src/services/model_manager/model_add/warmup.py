@@ -0,0 +1,168 @@
+import numpy as np
+
+import os
+import time
+import redis
+import logging
+import sparse_input
+import tensor_types
+
+WARMUP_ENABLED = os.environ.get('MODEL_WARMUP', 'false').lower() == 'true'
+
+WARMUP_BATCH_SIZES = [int(batch_size)
+                      for batch_size in os.environ.get('MODEL_WARMUP_BATCH_SIZES', '1,2,4,8').split(',')
+                      if batch_size.strip()]
+
+WARMUP_ITERATIONS = int(os.environ.get('MODEL_WARMUP_ITERATIONS', '5'))
+
+logger = logging.getLogger(__name__)
+
+
+# Fields of a previous registration, removed when the version is loaded again.
+# 'nodes' is kept, since the copies it lists keep serving until model_add records the new ones.
+REGISTRATION_FIELDS = ['profile', 'error']
+
+
+# Every registered model gets a hash 'model_info:<model_name>/<model_version>' holding its
+# 'status' ('loading', 'warming_up', 'ready' or 'failed' with an 'error'), the RedisAI 'nodes'
+# holding it and, when warm-up ran, its latency profile.
+def model_info_key(model):
+    return 'model_info:' + model
+
+
+def set_model_status(redis_client, model, status, **fields):
+    pipeline = redis_client.pipeline()
+    if status == 'loading':
+        pipeline.hdel(model_info_key(model), *REGISTRATION_FIELDS)
+    pipeline.hset(model_info_key(model),
+                  mapping={'status': status,
+                           'updated_at': str(time.time()),
+                           **fields})
+    pipeline.execute()
+
+
+def get_warmup_settings(model):
+    '''
+    Args:
+        model (dict): the 'model' object from <model_name>.json
+    Returns:
+        A dict with 'enabled', 'batch_sizes', 'iterations' and 'sample'.
+        The optional 'warmup' object of the JSON file overrides the environment defaults.
+    '''
+    settings = model.get('warmup', {})
+    return {"enabled": settings.get('enabled', WARMUP_ENABLED),
+            "batch_sizes": settings.get('batch_sizes', WARMUP_BATCH_SIZES),
+            "iterations": settings.get('iterations', WARMUP_ITERATIONS),
+            "sample": settings.get('sample')}
+
+
+# Builds one input for the given batch size.
+# A sample file ('.npy', already pre-processed, leading batch dimension of 1) takes precedence
+# over the declared input shape/dtype, since tensorflow models do not declare them.
+def create_warmup_input(model, model_path, sample, batch_size):
+    if sample:
+        sample_input = np.load(os.path.join(model_path, sample))
+        return np.ascontiguousarray(np.concatenate([sample_input] * batch_size, axis=0))
+
+    parameters = model['backend']['parameters']['input']
+    if 'shape' not in parameters or 'dtype' not in parameters:
+        return None
+
+    try:
+        # 'float' is float32 for RedisAI, as for the inference service
+        dtype = tensor_types.to_numpy_dtype(parameters['dtype'])
+    except ValueError:
+        return None
+
+    shape = [batch_size] + list(parameters['shape'][1:])
+    return np.random.random_sample(shape).astype(dtype)
+
+
+# Models declaring a 'sparse' input take the non-zero entries of the input as
+# 'indices', 'values' and 'dense_shape' tensors, like the inference service sends them.
+def create_input_tensors(model, model_input):
+    if not model['backend']['parameters']['input'].get('sparse'):
+        return [model_input]
+    return sparse_input.to_coo_tensors(model_input)
+
+
+def count_outputs(model):
+    if model['backend']['type'] == 'tensorflow':
+        return len(model['backend']['parameters']['output']['labels'])
+    # Same assumption as the inference service: output shape is always [1, x]
+    return model['backend']['parameters']['output']['shape'][1]
+
+
+def run_model(redis_client, model_key, model_inputs, outputs_size):
+    input_labels = [model_key + "_warmup_input_" + str(i) + "_" + str(time.time())
+                    for i in range(len(model_inputs))]
+    output_labels = [model_key + "_warmup_output_" + str(i) + "_" + str(time.time())
+                     for i in range(outputs_size)]
+    try:
+        for input_label, model_input in zip(input_labels, model_inputs):
+            redis_client.tensorset(input_label, model_input)
+        start = time.perf_counter()
+        redis_client.modelrun(model_key, input_labels, output_labels)
+        return time.perf_counter() - start
+    finally:
+        redis_client.delete(*input_labels, *output_labels)
+
+
+def summarize_latencies(latencies, batch_size):
+    latencies_ms = np.array(latencies) * 1000
+    return {"iterations": len(latencies),
+            "mean_ms": round(float(latencies_ms.mean()), 3),
+            "min_ms": round(float(latencies_ms.min()), 3),
+            "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+            "max_ms": round(float(latencies_ms.max()), 3),
+            "samples_per_second": round(batch_size / float(latencies_ms.mean() / 1000), 3)}
+
+
+def warmup_model(redis_client, model_key, model, model_path):
+    '''
+    Runs synthetic inputs through a model already set in RedisAI, for each batch size.
+    The first run of each batch size pays the backend initialization and is not measured.
+
+    Args:
+        redis_client (redisai.Client): client of a node holding the model
+        model_key (string): the model key in RedisAI
+            Ex: iris/1
+        model (dict): the 'model' object from <model_name>.json
+        model_path (string): the folder of the model version
+    Returns:
+        A dict mapping each batch size to its latency summary (or error), or None when
+        warm-up is disabled or no input could be built for the model.
+    '''
+    settings = get_warmup_settings(model)
+    if not settings['enabled']:
+        return None
+
+    outputs_size = count_outputs(model)
+    profile = {}
+
+    for batch_size in settings['batch_sizes']:
+        model_input = create_warmup_input(model,
+                                          model_path,
+                                          settings['sample'],
+                                          batch_size)
+        if model_input is None:
+            logger.info("No input shape/dtype or sample file for model '%s'. Skipping warm-up.", model_key,
+                        extra={"event": "warmup_skipped", "model": model_key})
+            return None
+
+        model_inputs = create_input_tensors(model, model_input)
+        try:
+            run_model(redis_client, model_key, model_inputs, outputs_size)
+            latencies = [run_model(redis_client, model_key, model_inputs, outputs_size)
+                         for _ in range(settings['iterations'])]
+            profile[str(batch_size)] = summarize_latencies(latencies, batch_size)
+        except redis.exceptions.ResponseError as err:
+            # Models exported with a fixed batch dimension reject larger batches
+            profile[str(batch_size)] = {"error": str(err)}
+
+        logger.debug("Warm-up for model '%s' with batch size %d", model_key, batch_size,
+                     extra={"event": "warmup", "model": model_key, "batch_size": batch_size,
+                            "profile": profile[str(batch_size)]})
+
+    return profile
@@ -1,37 +1,43 @@
 import logging
-import redisai
+import tracing
+import sharding
+import structured_logging
 
-logging.basicConfig(format='%(message)s', level=logging.INFO)
+structured_logging.setup_logging()
 logger = logging.getLogger(__name__)
 
-redis_client = redisai.Client(host='redisai', port=6379)
+redis_client = sharding.control_client
 
 
 def remove_model_from_redis():
     while True:
-        model = redis_client.blpop('models_to_delete')[1].decode('utf-8')
+        model, parent = tracing.extract(redis_client.blpop('models_to_delete')[1].decode('utf-8'))
+        removal_span, token = tracing.start_span('model_remove', parent)
+        removal_span.set('model', model)
 
         [model_name, model_version] = model.split('/')
 
-        if model_version == '*':
-            logger.info("Removing all versions of model '" +
-                        model_name + "' from RedisAI...")
-        else:
-            logger.info("Removing model '" + model + "' from RedisAI...")
-
         try:
-            for redis_model in redis_client.scan_iter(match=model):
-                redis_client.delete(redis_model)
+            # Every node is scanned, since copies may be left on nodes that owned the model before a rebalance
+            for node_client in sharding.clients.values():
+                for redis_model in node_client.scan_iter(match=model):
+                    node_client.delete(redis_model)
+            # Status and warm-up profile written by model_add
+            for model_info in redis_client.scan_iter(match='model_info:' + model):
+                redis_client.delete(model_info)
         except Exception as err:
             if model_version == '*':
-                logger.info("An error occured while removing all versions of model '" +
-                            model_name + "' from RedisAI")
+                logger.error("An error occured while removing all versions of model '%s' from RedisAI", model_name,
+                             extra={"event": "model_remove_error", "model": model, "error": str(err)})
             else:
-                logger.info("An error occured while removing model '" +
-                            model + "' from RedisAI")
+                logger.error("An error occured while removing model '%s' from RedisAI", model,
+                             extra={"event": "model_remove_error", "model": model, "error": str(err)})
 
         if model_version == '*':
-            logger.info("All versions of model '" +
-                        model_name + "' were removed from RedisAI")
+            logger.info("All versions of model '%s' were removed from RedisAI", model_name,
+                        extra={"event": "model_removed", "model": model})
         else:
-            logger.info("Model '" + model + "' was removed from RedisAI")
+            logger.info("Model '%s' was removed from RedisAI", model,
+                        extra={"event": "model_removed", "model": model})
+
+        tracing.end_span(removal_span, token)
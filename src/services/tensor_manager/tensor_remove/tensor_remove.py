@@ -1,20 +1,49 @@
+import os
+import time
 import logging
-import redisai
+import tracing
+import sharding
+import threading
+import structured_logging
 
-logging.basicConfig(format='%(message)s', level=logging.INFO)
+structured_logging.setup_logging()
 logger = logging.getLogger(__name__)
 
-redis_client = redisai.Client(host='redisai', port=6379)
+# Seconds a consumer waits before reading its queue again after an error (e.g. the node restarting)
+TENSOR_REMOVE_RETRY_INTERVAL = float(os.environ.get('TENSOR_REMOVE_RETRY_INTERVAL', '1'))
 
 
-def remove_tensor_from_redis():
-    while True:
-        tensor = redis_client.blpop('tensors_to_delete')[1].decode('utf-8')
-        logger.info("New tensor to remove: '" + tensor + "'")
+def remove_next_tensor(redis_client):
+    tensor, parent = tracing.extract(redis_client.blpop('tensors_to_delete')[1].decode('utf-8'))
+    logger.debug("New tensor to remove: '%s'", tensor, extra={"event": "tensor_received", "tensor": tensor})
 
+    with tracing.span('tensor_remove', parent, tensor=tensor):
         try:
             redis_client.delete(tensor)
-            logger.info("Tensor '" + tensor + "' removed from RedisAI")
+            # Every inference removes tensors, so this event is usually sampled (LOG_SAMPLE_RATES)
+            logger.info("Tensor '%s' removed from RedisAI", tensor,
+                        extra={"event": "tensor_removed", "tensor": tensor})
+        except Exception as err:
+            logger.error("An error occured while removing tensor '%s' from RedisAI", tensor,
+                         extra={"event": "tensor_remove_error", "tensor": tensor, "error": str(err)})
+
+
+def remove_tensors(node, redis_client):
+    # An unreachable node must not stop its consumer for good, since no other thread reads its queue
+    while True:
+        try:
+            remove_next_tensor(redis_client)
         except Exception as err:
-            logger.info("An error occured while removing tensor '" +
-                        tensor + "' from RedisAI")
+            logger.error("Could not read the tensors to remove from node '%s'", node,
+                         extra={"event": "tensor_queue_error", "node": node, "error": str(err)})
+            time.sleep(TENSOR_REMOVE_RETRY_INTERVAL)
+
+
+def remove_tensor_from_redis():
+    # Tensors are queued on the node holding them, so every node has its own consumer
+    threads = [threading.Thread(target=remove_tensors, args=(node, redis_client), daemon=True)
+               for node, redis_client in sharding.clients.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()